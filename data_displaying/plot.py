@@ -20,6 +20,7 @@ from pandas.plotting import register_matplotlib_converters
 # fixing the future pandas warning
 register_matplotlib_converters()
 
+import definitions
 from data_processing import arima as ari
 from data_preparing import dataset_handler as dh
 
@@ -166,10 +167,10 @@ class Plot:
         first_scene = self.find_scene(first_date)
         second_scene = self.find_scene(second_date)
 
-        first_path = os.path.join(path, first_scene + "_NDSI.TIF")
-        second_path = os.path.join(path, second_scene + "_NDSI.TIF")
+        first_path = self.find_ndsi_path(path, first_scene)
+        second_path = self.find_ndsi_path(path, second_scene)
 
-        if os.path.isfile(first_path) and os.path.isfile(second_path):
+        if first_path and second_path:
             task = ["python3", "data_processing/difference_movement.py",
                     first_path, second_path, path, first_scene, second_scene]
             self.sp.append(subprocess.Popen(task))
@@ -178,6 +179,21 @@ class Plot:
                            horizontalalignment='center', verticalalignment='center',
                            fontsize=12, bbox=dict(facecolor='red'))
 
+    @staticmethod
+    def find_ndsi_path(path, scene):
+        """
+        Finds the NDSI image of a scene, or its transform file if the scene was processed in the transform output mode.
+        :param path: The path_row output directory.
+        :param scene: The scene name.
+        :return: The path, or None if the scene has no output.
+        """
+        for end in (definitions.NDSI_END, definitions.TRANSFORM_END):
+            scene_path = os.path.join(path, scene + end)
+            if os.path.isfile(scene_path):
+                return scene_path
+
+        return None
+
     def find_scene(self, date) -> str:
         """
         Find the scene of processing based on the picked date.
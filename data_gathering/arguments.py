@@ -68,6 +68,20 @@ class ArgsParser:
                                     default=definitions.MAX_PROCESSES,
                                     type=int,
                                     dest='j')
+        process_parser.add_argument('--backend',
+                                    help='How the scenes are processed: one subprocess per scene, or a pool of long '
+                                         'lived worker processes.',
+                                    default=definitions.DEFAULT_BACKEND,
+                                    choices=definitions.BACKENDS,
+                                    type=str,
+                                    dest='backend')
+        process_parser.add_argument('--output-mode',
+                                    help='Write the warped bands and NDSI of each aligned scene, or only its affine '
+                                         'transform, which is applied when the scene is read.',
+                                    default=definitions.DEFAULT_OUTPUT_MODE,
+                                    choices=definitions.OUTPUT_MODES,
+                                    type=str,
+                                    dest='output_mode')
         process_parser.set_defaults(func=set_process_function)
 
     def add_display_arguments(self) -> None:
@@ -135,7 +149,7 @@ def set_process_function(args) -> None:
     """
     print("Setting up process...")
 
-    processor = process.Process(args.bigdir, args.input, args.output, args.j)
+    processor = process.Process(args.bigdir, args.input, args.output, args.j, args.backend, args.output_mode)
     processor.start()
 
     print("Finished process.")
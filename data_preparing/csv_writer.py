@@ -10,6 +10,8 @@ import definitions
 
 ALIGN_CSV = 'align'
 NDSI_CSV = 'ndsi'
+TIER_CSV = 'tier'
+HISTOGRAM_CSV = 'histogram'
 
 
 class CSVWriter:
@@ -18,14 +20,15 @@ class CSVWriter:
     which will be used by ARIMA in order to make the prediction on snow coverage.
     """
 
-    def __init__(self, output_dir, arguments, path=None, row=None):
+    def __init__(self, output_dir, arguments, path=None, row=None, kind=NDSI_CSV):
         """
-        Writes or appends to a csv based on the option (either align or process ndsi).
+        Writes or appends to a csv based on the option (either align or a per scene csv of a path_row).
         :param arguments: arguments of alignment or ndsi
+        :param kind: The per scene csv which is written when path and row are specified, ndsi, tier or histogram.
         """
-        # if path and row are specified that means that the csv is done for the ndsi calculation, not alignment; align
+        # if path and row are specified that means that the csv is done for the scenes of a path_row, not alignment
         if path and row:
-            self.csv_name = NDSI_CSV + "_" + path + "_" + row + ".csv"
+            self.csv_name = kind + "_" + path + "_" + row + ".csv"
         else:
             self.csv_name = ALIGN_CSV
 
@@ -62,6 +65,10 @@ class CSVWriter:
                         # ndsi
                     elif NDSI_CSV in self.csv_name:
                         writer.writerow(self.get_default_ndsi_csv())
+                    elif TIER_CSV in self.csv_name:
+                        writer.writerow(self.get_default_tier_csv())
+                    elif HISTOGRAM_CSV in self.csv_name:
+                        writer.writerow(self.get_default_histogram_csv())
                     else:
                         print(definitions.PRINT_CODES[1] + "There option is not valid. Not writing.")
                         return
@@ -115,3 +122,37 @@ class CSVWriter:
             'SNOW_RATIO'
         ]
         return attributes
+
+    @staticmethod
+    def get_default_tier_csv() -> list:
+        """
+        Creates the default tier csv design, which records for each aligned scene the alignment tier which produced its
+        valid transform, in order to see which scenes needed the expensive tiers.
+        :return: list which will represent the keys for the tier csv dictionary.
+        """
+        attributes = [
+            'GLACIER_ID',
+            'SCENE',
+            'PATH',
+            'ROW',
+            'TIER'
+        ]
+        return attributes
+
+    @staticmethod
+    def get_default_histogram_csv() -> list:
+        """
+        Creates the default histogram csv design, which holds for each scene the counts of its NDSI histogram, written
+        next to its ndsi csv item, so that the snow ratio of another threshold is found without the images. BIN_k
+        counts the NDSI values in (-1 + 2k / bins, -1 + 2(k + 1) / bins], and BORDER the pixels where a band is 0.
+        :return: list which will represent the keys for the histogram csv dictionary.
+        """
+        attributes = [
+            'GLACIER_ID',
+            'SCENE',
+            'PATH',
+            'ROW'
+        ]
+        attributes += ['BIN_' + str(index) for index in range(definitions.NDSI_HISTOGRAM_BINS)]
+        attributes.append('BORDER')
+        return attributes
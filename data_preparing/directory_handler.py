@@ -112,7 +112,7 @@ class OutputDirHandler:
 
         if os.path.exists(glacier_dir) and self.clearmeup is False:
             print(definitions.PRINT_CODES[0] + magenta("Cleanup"), glacier_dir);
-            shutil.rmtree(glacier_dir)
+            self.clear_glacier_dir(glacier_dir)
 
         self.clearmeup = True
 
@@ -123,6 +123,27 @@ class OutputDirHandler:
 
         return glacier_dir
 
+    @staticmethod
+    def clear_glacier_dir(glacier_dir) -> None:
+        """
+        Removes the results of a previous run from the glacier directory. The cache directories of the path_row
+        directories are kept, so that a rerun reuses the cached reference features and transforms.
+        :param glacier_dir: The glacier directory.
+        :return: None
+        """
+        for entry in os.scandir(glacier_dir):
+            if not entry.is_dir():
+                os.remove(entry.path)
+                continue
+
+            for path_row_entry in os.scandir(entry.path):
+                if path_row_entry.name == definitions.CACHE_DIR:
+                    continue
+                if path_row_entry.is_dir():
+                    shutil.rmtree(path_row_entry.path)
+                else:
+                    os.remove(path_row_entry.path)
+
     def make_path_row_directory(self, path_row) -> str:
         """
         Creates a directory of the form glacier_id/path_row which will keep the results. If the directory exists, it
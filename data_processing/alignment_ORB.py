@@ -2,9 +2,11 @@ from __future__ import print_function
 
 import cProfile
 import io
+import json
 import pstats
 import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 
 def interrupt_handler(signum, frame):
@@ -32,38 +34,144 @@ except ImportError:
 import sys
 
 sys.path.append(sys.path[0] + '/..')
+import definitions
 from data_processing import scenes as sc
 from data_processing import ndsi as nc
+from data_processing import cache as ch
+from data_processing import features as fe
+from data_processing import alignment_ECC as ecc
+from data_processing import georeference as geo
+from data_processing import snow_table as st
+from data_processing import snow_mask as sm
 from data_preparing import csv_writer
 from data_gathering import scene_information as sd
+from util import memory
 
 DEBUG_OUTLIERS = False
 DEBUG_TRANSFORM_MATRIX = False
+DIAGNOSTICS = False  # draw the matches, dump the inliers and outliers and print the transforms
+DIAGNOSTICS_DIR = None  # if set, the matches images of the diagnostics mode are written in this directory
 
 MAX_FEATURES = 5000  # number of feature points taken
 GOOD_MATCH_PERCENT = 0.25
 ALLOWED_ROTATION = 0.01  # the allowed rotation
 ALLOWED_TRANSLATION = 100  # the allowed translation
 EUCLIDIAN_DISTANCE = 200  # the allowed distance between two points so that the match line is as straight as possible
+ORB_SCALE_FACTOR = 2  # the pyramid decimation ratio of the ORB detector
+ORB_LEVELS = 8  # the number of pyramid levels of the ORB detector
+ORB_PATCH_SIZE = 100  # the size of the patch used by the ORB descriptor
+ORB_MIN_PATCH_SIZE = 31  # the smallest patch size, used on the downscaled pyramid levels
+DETECTION_THREADS = 4  # the number of threads detecting the features of the boxes, 1 for serial detection
+REFERENCE_CACHE = True  # reuse the reference features of the path_row instead of describing the reference each time
+TRANSFORM_CACHE = True  # reuse the affine, or the failure, of a scene aligned by a previous run with the same parameters
+MEMORY_BUDGET = False  # lower the peak memory of a scene, at the cost of some recomputation, see align_scene
+GLACIER_WINDOW = False  # read and align only the window of the scenes around the glacier of the output directory
+GLACIER_WINDOW_SIZE = 2000  # the side of the glacier window, in pixels
+SNOW_TABLES = False  # write the summed-area tables of the snow pixels, for querying the snow ratio of any glacier
+SNOW_MASKS = False  # write the bit packed snow mask of the aligned scene, for the snow change statistics of a path_row
+
+# alignment modes
+ORB_MODE = 'orb'  # detect and match the features on the full size image
+PYRAMID_MODE = 'pyramid'  # detect and match the features on a downscaled level, then refine on the finer levels
+CASCADE_MODE = 'cascade'  # try the cheap tiers first: phase correlation, ORB with few features, then ORB
+ALIGNMENT_MODE = ORB_MODE
+
+# alignment cascade
+PHASE_TIER = 'phase'  # the translation found by phase correlation
+SMALL_ORB_TIER = 'orb_small'  # ORB with CASCADE_SMALL_FEATURES feature points
+ECC_TIER = 'ecc'  # the ECC fallback
+PHASE_FACTOR = 4  # the downscale factor of the level the phase correlation runs on
+PHASE_MIN_RESPONSE = 0.2  # the minimal peak response of an accepted phase correlation
+CASCADE_SMALL_FEATURES = 1000  # the number of feature points of the small ORB tier, capped at MAX_FEATURES
+
+# descriptor matchers
+BRUTEFORCE_MATCHER = 'bruteforce'  # every reference descriptor against every image descriptor, best GOOD_MATCH_PERCENT
+CROSSCHECK_MATCHER = 'crosscheck'  # brute force, keeping only the pairs which are each other's best match
+FLANN_MATCHER = 'flann'  # approximate nearest neighbours with a LSH index, filtered with the ratio test
+MATCHERS = (BRUTEFORCE_MATCHER, CROSSCHECK_MATCHER, FLANN_MATCHER)
+MATCHER = BRUTEFORCE_MATCHER
+RATIO_TEST = 0.8  # a match is kept if it is closer than this ratio of the second best match
+FLANN_LSH_TABLES = 6  # the number of hash tables of the LSH index
+FLANN_LSH_KEY_SIZE = 12  # the number of bits of the hash keys
+FLANN_LSH_PROBE_LEVEL = 1  # how many neighbouring buckets are searched
+FLANN_CHECKS = 50  # the number of leaves searched
+CELL_MATCHING = False  # match each reference box only with the image points of the same and the adjacent boxes
+
+# coarse to fine alignment
+PYRAMID_FACTOR = 8  # the downscale factor of the coarsest level, a power of 2
+PYRAMID_ORB_LEVELS = 2  # the boxes of the coarsest level are small, so the ORB detector uses fewer levels
+REFINE_PATCH_SIZE = 64  # the size of the reference patch searched for on each finer level
+REFINE_SEARCH_RADIUS = 8  # how many pixels around the predicted position the patch is searched for
+REFINE_MIN_SCORE = 0.6  # the minimal normalized correlation of a patch match
+REFINE_MIN_DEVIATION = 2.0  # patches with a lower standard deviation are flat (e.g. the zero border) and skipped
+REFINE_MIN_POINTS = 6  # the minimal number of patch matches needed for refining a level
+REFINE_REPROJECTION_ERROR = 2.0  # the RANSAC reprojection threshold on the refined levels
+
+# correlation alignment
+ECC_REFINE = False  # refine the valid feature affine with ECC
+ECC_FALLBACK = True  # align with ECC alone when the features give no valid affine
+ECC_COARSEST_FACTOR = 8  # the downscale factor of the level the ECC fallback starts on
+ECC_REFINE_FACTOR = 4  # the downscale factor of the level the ECC refinement starts on
+ECC_FINEST_FACTOR = 2  # the downscale factor of the last ECC level, 1 for the full resolution
 
 # the number of boxes the image will be split into
 ROWS_NUMBER = 8  # the number of rows the full image will be split into for box matching
 COLUMNS_NUMBER = 8  # the number of columns the full image will be split into for box matching
 
+# the settings a tuning profile may set, see data_processing/tuning.py
+PROFILE_PARAMETERS = ('MAX_FEATURES', 'GOOD_MATCH_PERCENT', 'ROWS_NUMBER', 'COLUMNS_NUMBER')
+
 NDSI_CSV = 'ndsi'
 
+# reference features kept in memory by a long lived worker, keyed on the reference feature cache key
+RESIDENT_REFERENCES = {}
+
 
 class ProcessImage:
     """Class which handles ORB alignment of two images."""
 
-    def __init__(self, scene: sc.PathScene, reference_scene: sc.PathScene, aligned_scene: sc.PathScene):
-        self.image_16bit = sc.NumpyScene.read(scene)
-        self.reference_16bit = sc.NumpyScene.read(reference_scene)
-        self.aligned_16bit = None
-
+    def __init__(self, scene: sc.PathScene, reference_scene: sc.PathScene, aligned_scene: sc.PathScene,
+                 output_mode=definitions.DEFAULT_OUTPUT_MODE):
         self.scene = scene
         self.reference_scene = reference_scene
         self.aligned_scene = aligned_scene
+        self.output_mode = output_mode
+
+        self.window = None
+        self.reference_window = None
+        if GLACIER_WINDOW:
+            self.window, self.reference_window = self.glacier_windows()
+
+        self.image_16bit = sc.StackedScene.read(scene, window=self.window)
+        self.reference_16bit = None
+        self.aligned_16bit = None
+        self.transform = None
+        self.tier = None
+        # the snow classes of the scene, warped onto the reference by the alignment
+        self.snow_classes = None
+
+    def glacier_windows(self) -> tuple:
+        """
+        Finds the windows of the scene and of the reference around the glacier, from the coordinates in the name of the
+        glacier output directory. Each window is found from the georeferencing of its own scene, and the alignment
+        corrects the remaining offset between them.
+        :return: The windows of the scene and of the reference, or None for both if the glacier is not inside both.
+        """
+        path_row_dir, glacier_id, path, row = self.csv_location(self.aligned_scene.green_path)
+        coordinates = geo.glacier_coordinates(glacier_id)
+        if coordinates is None:
+            print(yellow("[ INFO ] ") + "No glacier coordinates in " + glacier_id + ", aligning the whole scene.")
+            return None, None
+
+        lon, lat = coordinates
+        window = geo.glacier_window(self.scene.green_path, lon, lat, GLACIER_WINDOW_SIZE)
+        reference_window = geo.glacier_window(self.reference_scene.green_path, lon, lat, GLACIER_WINDOW_SIZE)
+        if window is None or reference_window is None:
+            print(yellow("[ INFO ] ") + "The glacier is not inside " + self.scene.get_scene_name() +
+                  " or its reference, aligning the whole scene.")
+            return None, None
+
+        return window, reference_window
 
     def ndsi(self):
         """
@@ -71,44 +179,100 @@ class ProcessImage:
         :return: sc.SatImage
         """
         if self.aligned_16bit is not None:
-            self.aligned_16bit = sc.NumpySceneWithNDSI(self.aligned_16bit.green_numpy,
-                                                       self.aligned_16bit.swir1_numpy,
-                                                       nc.NDSI.calculate_NDSI(self.aligned_16bit))
+            ndsi = nc.NDSI.calculate_NDSI(self.aligned_16bit)
+            self.aligned_16bit = self.with_ndsi(self.aligned_16bit, ndsi)
             image_with_ndsi_16bit = self.aligned_16bit
         else:
-            self.image_16bit = sc.NumpySceneWithNDSI(self.image_16bit.green_numpy,
-                                                     self.image_16bit.swir1_numpy,
-                                                     nc.NDSI.calculate_NDSI(self.image_16bit))
-            h = nc.NDSI()
-            ndsi = nc.NDSI.calculate_NDSI(self.image_16bit)
-            snow_image = h.get_snow_image(ndsi=ndsi)
-
-            snow_pixels_ratio = h.get_snow_pixels_ratio(snow_image=snow_image, threshold=0.5)
+            # a single pass gives the histogram, the block counts of the snow tables, the classes of the snow mask and
+            # the NDSI; the histogram bin edges fall on the 0.5 threshold, so the ratio found from the histogram is
+            # exact. The NDSI is warped and written only in the raster output mode; in the memory budget mode it is
+            # not kept during the alignment, but streamed from the written aligned bands
+            keep_ndsi = self.output_mode == definitions.RASTER_OUTPUT and not MEMORY_BUDGET
+            statistics = nc.NDSI.get_snow_statistics(self.image_16bit, threshold=0.5,
+                                                     block=definitions.SNOW_TABLE_BLOCK if SNOW_TABLES else None,
+                                                     classes=SNOW_MASKS, ndsi=keep_ndsi)
+            if keep_ndsi:
+                self.image_16bit = self.with_ndsi(self.image_16bit, statistics['ndsi'])
+            histogram = statistics['histogram']
+            snow_pixels_ratio = nc.NDSI.get_snow_pixels_ratio_from_histogram(histogram, threshold=0.5)
+            if SNOW_TABLES:
+                self.write_snow_table(statistics['snow_counts'], statistics['valid_counts'])
+            self.snow_classes = statistics['classes']
 
             image_with_ndsi_16bit = self.image_16bit
-            self.write_ndsi_csv(path=aligned_scene.green_path,
-                                scene=aligned_scene.get_scene_name(),
+            self.write_ndsi_csv(path=self.aligned_scene.green_path,
+                                scene=self.aligned_scene.get_scene_name(),
                                 snow_ratio=snow_pixels_ratio)
+            self.write_histogram_csv(path=self.aligned_scene.green_path,
+                                     scene=self.aligned_scene.get_scene_name(),
+                                     histogram=histogram)
 
         return image_with_ndsi_16bit
 
+    def stream_ndsi(self) -> None:
+        """
+        Writes the NDSI of the aligned scene, streamed strip by strip from its written bands, so that neither the
+        aligned bands nor their NDSI image are held in memory. The NDSI is georeferenced with the reference and its
+        window, like the NDSI written with the aligned bands.
+        :return: None
+        """
+        self.aligned_16bit = None
+        nc.NDSI.stream_NDSI(self.aligned_scene, threshold=None,
+                            ndsi_path=sc.NumpySceneWithNDSI.ndsi_path(self.aligned_scene),
+                            reference_scene=self.reference_scene, reference_window=self.reference_window)
+
+    def write_snow_table(self, snow_counts, valid_counts) -> None:
+        """
+        Writes the summed-area tables of the snow and valid pixel counts of the scene next to its outputs. The tables
+        are in the pixels of the scene, not of the reference, so they are queried with the georeferencing of the scene,
+        whose band path is stored absolute.
+        :param snow_counts: The snow pixel count of each block.
+        :param valid_counts: The valid pixel count of each block.
+        :return: None
+        """
+        table = st.SnowTable.from_counts(snow_counts, valid_counts, definitions.SNOW_TABLE_BLOCK,
+                                         os.path.abspath(self.scene.green_path), self.window)
+        output_dir = os.path.split(self.aligned_scene.green_path)[0]
+        table.write(os.path.join(output_dir, self.aligned_scene.get_scene_name() + definitions.SNOW_TABLE_END))
+
     @staticmethod
-    def write_ndsi_csv(path, scene, snow_ratio):
-        print(yellow("[ INFO  ]: ") + yellow("Writing NDSI item..."))
+    def with_ndsi(scene: sc.NumpyScene, ndsi) -> sc.NumpySceneWithNDSI:
+        """
+        Attaches the NDSI image to a scene, keeping the bands stacked if they are.
+        :param scene: The scene.
+        :param ndsi: The NDSI image of the scene.
+        :return: sc.NumpySceneWithNDSI or sc.StackedSceneWithNDSI
+        """
+        if isinstance(scene, sc.StackedScene):
+            return sc.StackedSceneWithNDSI(scene.stack, ndsi)
+
+        return sc.NumpySceneWithNDSI(scene.green_numpy, scene.swir1_numpy, ndsi)
+
+    @staticmethod
+    def csv_location(path) -> tuple:
+        """
+        Finds the path_row output directory of an aligned band, and the glacier, path and row it belongs to.
+        :param path: Path to the aligned band, in the glacier/path_row output directory.
+        :return: The path_row directory, the glacier id, the path and the row.
+        """
         path_row_dir = pathlib.Path(path).parents[0]
         glacier_dir, path_row = os.path.split(path_row_dir)
         glacier_dir = pathlib.Path(path).parents[1]
         parent_dir, glacier_id = os.path.split(glacier_dir)
 
+        path_row = path_row.split("_")
+        return path_row_dir, glacier_id, path_row[0], path_row[1]
+
+    @staticmethod
+    def write_ndsi_csv(path, scene, snow_ratio):
+        print(yellow("[ INFO  ]: ") + yellow("Writing NDSI item..."))
+        path_row_dir, glacier_id, path, row = ProcessImage.csv_location(path)
+
         h = sd.SceneInformation(scene=scene)
         year = h.get_year()
         month = h.get_month()
         day = h.get_day()
 
-        path_row = path_row.split("_")
-        path = path_row[0]
-        row = path_row[1]
-
         arguments = [
             glacier_id,
             scene,
@@ -126,24 +290,183 @@ class ProcessImage:
                                  row=row)
         h.start()
 
+    @staticmethod
+    def write_tier_csv(path, scene, tier):
+        """
+        Records the alignment tier which produced the transform of the scene.
+        :param path: Path to the aligned band.
+        :param scene: The scene name.
+        :param tier: The alignment tier.
+        :return: None
+        """
+        path_row_dir, glacier_id, path, row = ProcessImage.csv_location(path)
+
+        arguments = [
+            glacier_id,
+            scene,
+            path,
+            row,
+            tier
+        ]
+
+        h = csv_writer.CSVWriter(output_dir=path_row_dir,
+                                 arguments=arguments,
+                                 path=path,
+                                 row=row,
+                                 kind=csv_writer.TIER_CSV)
+        h.start()
+
+    @staticmethod
+    def write_histogram_csv(path, scene, histogram):
+        """
+        Records the NDSI histogram of the scene, next to its ndsi csv item.
+        :param path: Path to the aligned band.
+        :param scene: The scene name.
+        :param histogram: The counts of the NDSI bins, followed by the number of border pixels.
+        :return: None
+        """
+        path_row_dir, glacier_id, path, row = ProcessImage.csv_location(path)
+
+        arguments = [
+            glacier_id,
+            scene,
+            path,
+            row
+        ]
+        arguments += [int(count) for count in histogram]
+
+        h = csv_writer.CSVWriter(output_dir=path_row_dir,
+                                 arguments=arguments,
+                                 path=path,
+                                 row=row,
+                                 kind=csv_writer.HISTOGRAM_CSV)
+        h.start()
+
     def align(self):
         """
-        Align scene with reference, then ndsi with aligned (the new reference )
-        :return:
+        Align scene with reference, then ndsi with aligned (the new reference ). In the transform output mode only the
+        affine matrix is kept, and the bands are not warped. The affine is taken from the transform cache if a previous
+        run already aligned the scene.
+        :return: The aligned scene, the sc.TransformScene in the transform output mode, or None if the alignment failed.
         """
-        align = AlignORB(self.image_16bit, self.reference_16bit)
-        self.aligned_16bit = align.align()
-        if self.aligned_16bit is None:
+        output_dir = os.path.split(self.aligned_scene.green_path)[0]
+        parameters = AlignORB.alignment_parameters()
+        parameters['GLACIER_WINDOW'] = [self.window, self.reference_window]
+        cache = ch.TransformCache(output_dir=output_dir,
+                                  scene=self.scene,
+                                  reference_scene=self.reference_scene,
+                                  parameters=parameters)
+
+        entry = cache.load() if TRANSFORM_CACHE else None
+        if entry is None:
+            affine, size = self.find_affine()
+            if TRANSFORM_CACHE:
+                cache.store(affine, self.tier, size)
+        else:
+            print(yellow("[ INFO ] ") + "Using the cached transform of " + self.scene.get_scene_name())
+            affine, self.tier, size = entry['affine'], entry['tier'], (entry['width'], entry['height'])
+
+        if affine is None:
             return None
 
+        if self.snow_classes is not None:
+            # the nearest neighbour keeps the classes, and the pixels outside the scene get no data
+            self.snow_classes = cv2.warpAffine(self.snow_classes, affine, size, flags=cv2.INTER_NEAREST,
+                                               borderValue=sm.NO_DATA_CLASS)
+
+        if self.output_mode == definitions.TRANSFORM_OUTPUT:
+            self.image_16bit = None
+            self.transform = sc.TransformScene(self.scene, affine, size, self.window)
+            return self.transform
+
+        self.aligned_16bit = AlignORB.warp_scene(self.image_16bit, affine, size)
+        # the input is not needed once it is warped
+        self.image_16bit = None
+
         return self.aligned_16bit
 
+    def find_affine(self) -> tuple:
+        """
+        Aligns the scene with the reference.
+        :return: The affine matrix, None if the alignment failed, and the width and height of the reference.
+        """
+        align = AlignORB(self.image_16bit, reference_features=self.reference_features(),
+                         name=self.scene.get_scene_name())
+
+        if self.output_mode == definitions.TRANSFORM_OUTPUT:
+            # the transform is found on the 8 bit bands, the 16 bit bands are not warped
+            self.image_16bit = None
+            align.input_img = None
+
+        affine = align.get_align_affine_transformation()
+        if affine is not None:
+            self.tier = align.tier
+
+        height, width = align.align_reference.green_numpy.shape
+        return affine, (width, height)
+
+    def reference_features(self) -> ch.ReferenceFeatures:
+        """
+        Returns the features of the reference scene, from the path_row cache if they were already computed by another
+        alignment of the same path_row.
+        :return: ch.ReferenceFeatures
+        """
+        output_dir = os.path.split(self.aligned_scene.green_path)[0]
+        parameters = AlignORB.feature_parameters()
+        parameters['GLACIER_WINDOW'] = self.reference_window
+        cache = ch.ReferenceFeatureCache(output_dir=output_dir,
+                                         reference_scene=self.reference_scene,
+                                         parameters=parameters)
+
+        features = RESIDENT_REFERENCES.get(cache.key)
+        if features is not None:
+            return features
+
+        if REFERENCE_CACHE:
+            features = cache.get(self.compute_reference_features)
+        else:
+            features = self.compute_reference_features()
+
+        # a worker processes one path_row at a time, so only the last reference is kept
+        RESIDENT_REFERENCES.clear()
+        if not MEMORY_BUDGET:
+            RESIDENT_REFERENCES[cache.key] = features
+
+        return features
+
+    def compute_reference_features(self) -> ch.ReferenceFeatures:
+        """
+        Reads the reference scene and computes its features. The 16 bit reference is only needed for this.
+        :return: ch.ReferenceFeatures
+        """
+        self.reference_16bit = sc.StackedScene.read(self.reference_scene, window=self.reference_window)
+        features = AlignORB.describe_reference(self.reference_16bit)
+        self.reference_16bit = None
+
+        return features
+
     def write(self):
         """
         Write images to disk and to the csv
         :return:
         """
-        if self.aligned_16bit:
+        # outside the cascade every transform comes from the alignment mode, so only the ECC fallback is recorded
+        if self.tier is not None and (ALIGNMENT_MODE == CASCADE_MODE or self.tier == ECC_TIER):
+            self.write_tier_csv(path=self.aligned_scene.green_path,
+                                scene=self.aligned_scene.get_scene_name(),
+                                tier=self.tier)
+
+        if self.snow_classes is not None:
+            output_dir = os.path.split(self.aligned_scene.green_path)[0]
+            mask = sm.PackedSnowMask.from_classes(self.snow_classes)
+            mask.write(os.path.join(output_dir, self.aligned_scene.get_scene_name() + definitions.SNOW_MASK_END))
+
+        if self.transform is not None:
+            self.transform.write(self.aligned_scene)
+        elif isinstance(self.aligned_16bit, (sc.NumpySceneWithNDSI, sc.StackedSceneWithNDSI)):
+            # the NDSI is aligned onto the reference, so it is georeferenced with the reference and its window
+            self.aligned_16bit.write(self.aligned_scene, self.reference_scene, self.reference_window)
+        elif self.aligned_16bit:
             self.aligned_16bit.write(self.aligned_scene)
         else:
             print(red("Aligned 16 bit is none. Not writing."))
@@ -154,146 +477,749 @@ class AlignORB:
     Class which gets two images as input and alignes the image based on the reference.
     """
 
-    def __init__(self, input_img: sc.NumpyScene, reference_img: sc.NumpyScene):
+    def __init__(self, input_img: sc.NumpyScene, reference_img: sc.NumpyScene = None,
+                 reference_features: ch.ReferenceFeatures = None, name="scene"):
+        """
+        Prepares the 8 bit images used for alignment. The reference can be given either as the 16 bit scene, or as its
+        already computed features, in which case the reference is not described again.
+        :param input_img: The 16 bit scene which will be aligned.
+        :param reference_img: The 16 bit reference scene.
+        :param reference_features: The features of the reference scene.
+        :param name: The name of the input scene, used for naming the diagnostics files.
+        """
         # transform from scientific notation to decimal for easy check
         np.set_printoptions(suppress=True, precision=4)
 
         self.input_img = input_img
         self.reference_img = reference_img
+        self.name = name
+        self.tier = None
 
-        image_normalized = self.normalize(input_img)
-        reference_normalized = self.normalize(reference_img)
+        if reference_features is None:
+            reference_features = self.describe_reference(reference_img)
+        self.reference_features = reference_features
 
-        image_normnalized_8bit = self.downsample(image_normalized)
-        reference_normnalized_8bit = self.downsample(reference_normalized)
+        image_normnalized_8bit = self.normalize_8bit(input_img)
 
         self.align_input = image_normnalized_8bit
-        self.align_reference = reference_normnalized_8bit
+        self.align_reference = reference_features.reference_8bit
 
         sc.DISPLAY.numpy_scene("INPUT", self.input_img)
-        sc.DISPLAY.numpy_scene("REFERENCE", self.reference_img)
+        if self.reference_img is not None:
+            sc.DISPLAY.numpy_scene("REFERENCE", self.reference_img)
 
         sc.DISPLAY.numpy_scene("ALIGN_INPUT", self.align_input)
         sc.DISPLAY.numpy_scene("ALIGN_REFERENCE", self.align_reference)
 
-    def downsample(self, image_16bit):
+    @staticmethod
+    def describe_reference(reference_img: sc.NumpyScene) -> ch.ReferenceFeatures:
+        """
+        Normalizes the reference scene to 8 bit and computes the keypoints and descriptors of its bands.
+        :param reference_img: The 16 bit reference scene.
+        :return: ch.ReferenceFeatures
+        """
+        reference_normnalized_8bit = AlignORB.normalize_8bit(reference_img)
+
+        # the features are computed on the level the matching is done on
+        detection_level = AlignORB.detection_level(reference_normnalized_8bit)
+        patch_size, levels = AlignORB.detection_orb_parameters()
+        green, swir = AlignORB.box_detect_and_compute_all([detection_level.green_numpy, detection_level.swir1_numpy],
+                                                          patch_size=patch_size, levels=levels)
+
+        return ch.ReferenceFeatures(reference_normnalized_8bit, green, swir)
+
+    @staticmethod
+    def feature_parameters() -> dict:
+        """
+        Returns the parameters which influence the computed features, used for keying the reference feature cache.
+        :return: dict
+        """
+        return {
+            'MAX_FEATURES': MAX_FEATURES,
+            'ROWS_NUMBER': ROWS_NUMBER,
+            'COLUMNS_NUMBER': COLUMNS_NUMBER,
+            'ORB_SCALE_FACTOR': ORB_SCALE_FACTOR,
+            'ORB_PATCH_SIZE': ORB_PATCH_SIZE,
+            'ORB_MIN_PATCH_SIZE': ORB_MIN_PATCH_SIZE,
+            'ORB_LEVELS': ORB_LEVELS,
+            'ALIGNMENT_MODE': ALIGNMENT_MODE,
+            'PYRAMID_FACTOR': PYRAMID_FACTOR,
+            'PYRAMID_ORB_LEVELS': PYRAMID_ORB_LEVELS,
+            'OPENCV_VERSION': cv2.__version__
+        }
+
+    @staticmethod
+    def alignment_parameters() -> dict:
+        """
+        Returns the parameters which influence the affine matrix of an alignment, used for keying the transform cache.
+        :return: dict
+        """
+        parameters = AlignORB.feature_parameters()
+        parameters.update({
+            'GOOD_MATCH_PERCENT': GOOD_MATCH_PERCENT,
+            'ALLOWED_ROTATION': ALLOWED_ROTATION,
+            'ALLOWED_TRANSLATION': ALLOWED_TRANSLATION,
+            'EUCLIDIAN_DISTANCE': EUCLIDIAN_DISTANCE,
+            'MATCHER': MATCHER,
+            'RATIO_TEST': RATIO_TEST,
+            'FLANN': [FLANN_LSH_TABLES, FLANN_LSH_KEY_SIZE, FLANN_LSH_PROBE_LEVEL, FLANN_CHECKS],
+            'CELL_MATCHING': CELL_MATCHING,
+            'REFINE': [REFINE_PATCH_SIZE, REFINE_SEARCH_RADIUS, REFINE_MIN_SCORE, REFINE_MIN_DEVIATION,
+                       REFINE_MIN_POINTS, REFINE_REPROJECTION_ERROR],
+            'CASCADE': [PHASE_FACTOR, PHASE_MIN_RESPONSE, CASCADE_SMALL_FEATURES],
+            'ECC': [ECC_REFINE, ECC_FALLBACK, ECC_COARSEST_FACTOR, ECC_REFINE_FACTOR, ECC_FINEST_FACTOR,
+                    ecc.ECC_ITERATIONS, ecc.ECC_EPS, ecc.ECC_GAUSS_FILTER_SIZE, ecc.ECC_MIN_CORRELATION]
+        })
+
+        return parameters
+
+    @staticmethod
+    def detection_level(image_8bit: sc.NumpyScene) -> sc.NumpyScene:
+        """
+        Returns the image on which the features are detected and matched: the coarsest pyramid level in pyramid mode,
+        the image itself otherwise.
+        :param image_8bit: The 8 bit NumpyScene.
+        :return: sc.NumpyScene
+        """
+        if ALIGNMENT_MODE == PYRAMID_MODE:
+            return AlignORB.pyramid_level(image_8bit, PYRAMID_FACTOR)
+        return image_8bit
+
+    @staticmethod
+    def detection_orb_parameters() -> tuple:
+        """
+        Returns the ORB patch size and number of levels for the detection level, scaled down in pyramid mode.
+        :return: tuple
+        """
+        if ALIGNMENT_MODE == PYRAMID_MODE:
+            return max(ORB_MIN_PATCH_SIZE, ORB_PATCH_SIZE // PYRAMID_FACTOR), PYRAMID_ORB_LEVELS
+        return ORB_PATCH_SIZE, ORB_LEVELS
+
+    @staticmethod
+    def pyramid_level(image_8bit: sc.NumpyScene, factor) -> sc.NumpyScene:
+        """
+        Downscales the bands of the image by the given factor, averaging the pixels of each factor x factor area.
+        :param image_8bit: The 8 bit NumpyScene.
+        :param factor: The downscale factor.
+        :return: sc.NumpyScene
+        """
+        if factor == 1:
+            return image_8bit
+
+        height, width = image_8bit.green_numpy.shape
+        size = (width // factor, height // factor)
+        if isinstance(image_8bit, sc.StackedScene):
+            stack = sc.StackedScene.empty_stack((size[1], size[0]), image_8bit.stack.dtype)
+            for band in range(len(stack)):
+                cv2.resize(image_8bit.stack[band], size, dst=stack[band], interpolation=cv2.INTER_AREA)
+            return sc.StackedScene(stack)
+
+        green = cv2.resize(image_8bit.green_numpy, size, interpolation=cv2.INTER_AREA)
+        swir = cv2.resize(image_8bit.swir1_numpy, size, interpolation=cv2.INTER_AREA)
+
+        return sc.NumpyScene(green, swir)
+
+    @staticmethod
+    def level_to_full_affine(affine, factor) -> np.ndarray:
+        """
+        Converts an affine matrix estimated on a pyramid level to full resolution. The pixel x of the level is the
+        center of the factor x factor area, at factor * x + (factor - 1) / 2 in the full image.
+        :param affine: The 2x3 affine matrix of the level.
+        :param factor: The downscale factor of the level.
+        :return: np.ndarray
+        """
+        offset = np.full(2, (factor - 1) / 2)
+        linear = affine[:, 0:2]
+
+        full = affine.astype(np.float64)
+        full[:, 2] = factor * affine[:, 2] - (linear - np.identity(2)).dot(offset)
+        return full
+
+    @staticmethod
+    def full_to_level_affine(affine, factor) -> np.ndarray:
+        """
+        Converts a full resolution affine matrix to a pyramid level; the inverse of level_to_full_affine.
+        :param affine: The 2x3 full resolution affine matrix.
+        :param factor: The downscale factor of the level.
+        :return: np.ndarray
+        """
+        offset = np.full(2, (factor - 1) / 2)
+        linear = affine[:, 0:2]
+
+        level = affine.astype(np.float64)
+        level[:, 2] = (affine[:, 2] + (linear - np.identity(2)).dot(offset)) / factor
+        return level
+
+    @staticmethod
+    def normalize_8bit(image):
+        """
+        Normalizes the image and changes its depth to 8 bit, the same as downsample(normalize(image)). The bands of a
+        stacked scene go one at a time through a single 16 bit band buffer, so the normalized 16 bit scene is never
+        held whole.
+        :param image: The 16 bit scene.
+        :return: The 8 bit scene.
+        """
+        if not isinstance(image, sc.StackedScene):
+            return AlignORB.downsample(AlignORB.normalize(image))
+
+        normalized = np.empty(image.green_numpy.shape, dtype=image.stack.dtype)
+        stack = sc.StackedScene.empty_stack(image.green_numpy.shape, np.uint8)
+        for band in range(len(stack)):
+            cv2.normalize(image.stack[band], normalized, 0, (1 << 16) - 1, cv2.NORM_MINMAX)
+            np.right_shift(normalized, 8, out=normalized)
+            stack[band] = normalized
+
+        return sc.StackedScene(stack)
+
+    @staticmethod
+    def downsample(image_16bit):
         """
         Chanfes the depth of the inputted image to 8 bit.
         :param image_16bit:
         :return:
         """
+        if isinstance(image_16bit, sc.StackedScene):
+            return sc.StackedScene((image_16bit.stack >> 8).astype(np.uint8))
+
         image_8bit_green = (image_16bit.green_numpy >> 8).astype(np.uint8)
         image_8bit_swir = (image_16bit.swir1_numpy >> 8).astype(np.uint8)
 
         return sc.NumpyScene(image_8bit_green, image_8bit_swir)
 
-    def normalize(self, image, bits=16):
+    @staticmethod
+    def normalize(image, bits=16):
         """
         Normalizes the input image to be between 0 and the inputted bit range.
         :param image:
         :param bits:
         :return:
         """
+        if isinstance(image, sc.StackedScene):
+            stack = sc.StackedScene.empty_stack(image.green_numpy.shape, image.stack.dtype)
+            for band in range(len(stack)):
+                cv2.normalize(image.stack[band], stack[band], 0, (1 << bits) - 1, cv2.NORM_MINMAX)
+            return sc.StackedScene(stack)
+
         normalized_image_8bit_green = cv2.normalize(image.green_numpy, None, 0, (1 << bits) - 1, cv2.NORM_MINMAX)
         normalized_image_8bit_swir = cv2.normalize(image.swir1_numpy, None, 0, (1 << bits) - 1, cv2.NORM_MINMAX)
 
         return sc.NumpyScene(normalized_image_8bit_green, normalized_image_8bit_swir)
 
     @staticmethod
-    def box_detect_and_compute(image, rows=ROWS_NUMBER, columns=COLUMNS_NUMBER) -> tuple:
+    def box_detect_and_compute(image, rows=None, columns=None, patch_size=None, levels=None) -> fe.Features:
         """
         Splits the image in n boxes and applies feature finding in each, so that the points are evenly distributed,
         avoiding image distortion in the case there are feature points only in one part of the image.
         :param image: The image which will be split.
-        :param rows: Number of rows in which the image will be split
-        :param columns: Number of columns in which the image will be split
-        :return: The keypoints and descriptors of the whole image
+        :param rows: Number of rows in which the image will be split, ROWS_NUMBER if None
+        :param columns: Number of columns in which the image will be split, COLUMNS_NUMBER if None
+        :param patch_size: The size of the patch used by the ORB descriptor, ORB_PATCH_SIZE if None.
+        :param levels: The number of pyramid levels of the ORB detector, ORB_LEVELS if None.
+        :return: The features of the whole image
         """
-        orb = cv2.ORB_create(nfeatures=MAX_FEATURES // rows // columns, scaleFactor=2, patchSize=100)
+        return AlignORB.box_detect_and_compute_all([image], rows=rows, columns=columns,
+                                                   patch_size=patch_size, levels=levels)[0]
 
-        # list of keypoints of the whole image
-        keypoints = []
+    @staticmethod
+    def box_detect_and_compute_all(images, rows=None, columns=None, patch_size=None, levels=None,
+                                   max_features=None) -> list:
+        """
+        Applies the box feature finding on several images at once. Each box is detected and described on a crop padded
+        with patch_size pixels, with a mask restricting the keypoints to the box, so that the points close to the box
+        edges keep their descriptor patch. The boxes of all the images are processed concurrently on a pool of
+        DETECTION_THREADS threads, since OpenCV releases the GIL while detecting. The box features are merged in box
+        order, so the result does not depend on the order the threads finish in, and the strongest points of each box
+        are kept.
+        :param images: The list of images which will be split.
+        :param rows: Number of rows in which the images will be split, ROWS_NUMBER if None
+        :param columns: Number of columns in which the images will be split, COLUMNS_NUMBER if None
+        :param patch_size: The size of the patch used by the ORB descriptor, ORB_PATCH_SIZE if None.
+        :param levels: The number of pyramid levels of the ORB detector, ORB_LEVELS if None.
+        :param max_features: The number of feature points of an image, MAX_FEATURES if None.
+        :return: A list with the features of each image
+        """
+        # the settings are read when called, so that a loaded profile applies
+        rows = ROWS_NUMBER if rows is None else rows
+        columns = COLUMNS_NUMBER if columns is None else columns
+        patch_size = ORB_PATCH_SIZE if patch_size is None else patch_size
+        levels = ORB_LEVELS if levels is None else levels
+        max_features = MAX_FEATURES if max_features is None else max_features
+        budget = max_features // rows // columns
+
+        def detect_box(box):
+            image, x0, x1, y0, y1, cell = box
+            height, width = image.shape
+
+            padded_x0, padded_y0 = max(0, x0 - patch_size), max(0, y0 - patch_size)
+            padded_x1, padded_y1 = min(width, x1 + patch_size), min(height, y1 + patch_size)
+
+            mask = np.zeros((padded_y1 - padded_y0, padded_x1 - padded_x0), dtype=np.uint8)
+            mask[y0 - padded_y0:y1 - padded_y0, x0 - padded_x0:x1 - padded_x0] = 255
+
+            # a detector for each box, since the ORB objects are not shared between threads
+            orb = cv2.ORB_create(nfeatures=budget, scaleFactor=ORB_SCALE_FACTOR, nlevels=levels,
+                                 patchSize=patch_size)
+            keypoints, descriptors = orb.detectAndCompute(image[padded_y0:padded_y1, padded_x0:padded_x1], mask)
+
+            return fe.Features.from_keypoints(keypoints, descriptors, offset=(padded_x0, padded_y0), cell=cell)
+
+        # create the boxes, image by image
+        boxes = []
+        for image in images:
+            for x in range(0, columns):
+                for y in range(0, rows):
+                    x0 = x * image.shape[1] // columns
+                    x1 = (x + 1) * image.shape[1] // columns
+                    y0 = y * image.shape[0] // rows
+                    y1 = (y + 1) * image.shape[0] // rows
+                    boxes.append((image, x0, x1, y0, y1, y * columns + x))
+
+        if DETECTION_THREADS <= 1:
+            boxes_features = list(map(detect_box, boxes))
+        else:
+            with ThreadPoolExecutor(max_workers=DETECTION_THREADS) as executor:
+                boxes_features = list(executor.map(detect_box, boxes))
 
-        # create the box
-        for x in range(0, columns):
-            for y in range(0, rows):
-                x0 = x * image.shape[1] // columns
-                x1 = (x + 1) * image.shape[1] // columns
-                y0 = y * image.shape[0] // rows
-                y1 = (y + 1) * image.shape[0] // rows
+        boxes_number = rows * columns
+        images_features = []
+        for index in range(len(images)):
+            features = fe.Features.concatenate(boxes_features[index * boxes_number:(index + 1) * boxes_number])
+            images_features.append(features.select_best_per_cell(budget))
+
+        return images_features
 
-                image_box = image[y0:y1, x0:x1]
+    @staticmethod
+    def matches_to_arrays(matches) -> tuple:
+        """
+        Converts the cv2 matches to numpy arrays, in a single pass over the match objects.
+        :param matches: The cv2 matches.
+        :return: The indices of the reference features, the indices of the image features and the match distances.
+        """
+        array = np.array([(match.queryIdx, match.trainIdx, match.distance) for match in matches],
+                         dtype=np.float64).reshape(-1, 3)
 
-                # detect keypoints in the boxed image
-                box_keypoints = orb.detect(image_box)
+        return array[:, 0].astype(np.intp), array[:, 1].astype(np.intp), array[:, 2]
+
+    @staticmethod
+    def match_bands(reference_bands, image_bands) -> tuple:
+        """
+        Matches the features of each band only with the features of the same band of the other image, and merges the
+        matches of the bands, best first. The returned indices point into the concatenation of the bands, in order.
+        :param reference_bands: List with the Features of each reference band.
+        :param image_bands: List with the Features of each image band, in the same band order.
+        :return: The indices of the reference features, the indices of the image features and the match distances.
+        """
+        reference_offset = 0
+        image_offset = 0
+        band_matches = []
 
-                # append the box keypoints to the whole image keypoints
-                for keypoint in box_keypoints:
-                    keypoint.pt = (keypoint.pt[0] + x0, keypoint.pt[1] + y0)
-                    keypoints.append(keypoint)
+        for reference_features, image_features in zip(reference_bands, image_bands):
+            if len(reference_features) > 0 and len(image_features) > 0:
+                if CELL_MATCHING:
+                    reference_indices, image_indices, distances = \
+                        AlignORB.match_cells(reference_features, image_features)
+                else:
+                    reference_indices, image_indices, distances = \
+                        AlignORB.match_descriptors(reference_features.descriptors, image_features.descriptors)
+                band_matches.append((reference_indices + reference_offset, image_indices + image_offset, distances))
 
-        # compute the descriptors with the found keypoints
-        keypoints, descriptors = orb.compute(image, keypoints)
+            reference_offset += len(reference_features)
+            image_offset += len(image_features)
 
-        return keypoints, descriptors
+        if len(band_matches) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+        reference_indices, image_indices, distances = [np.concatenate(arrays) for arrays in zip(*band_matches)]
+        order = np.argsort(distances, kind='stable')
+
+        return reference_indices[order], image_indices[order], distances[order]
+
+    @staticmethod
+    def match_cells(reference_features: fe.Features, image_features: fe.Features, rows=None, columns=None) -> tuple:
+        """
+        Matches the points of each reference box only with the image points of the same box and of the 8 adjacent
+        boxes. A box is much larger than EUCLIDIAN_DISTANCE, so the correct matches are kept, while the global match
+        is split into many small ones. The boxes are matched concurrently on DETECTION_THREADS threads, and their matches
+        are merged in box order.
+        :param reference_features: The features of a reference band.
+        :param image_features: The features of the same image band.
+        :param rows: Number of rows of boxes the features were detected in, ROWS_NUMBER if None.
+        :param columns: Number of columns of boxes the features were detected in, COLUMNS_NUMBER if None.
+        :return: The indices of the reference features, the indices of the image features and the match distances.
+        """
+        rows = ROWS_NUMBER if rows is None else rows
+        columns = COLUMNS_NUMBER if columns is None else columns
+        image_rows, image_columns = np.divmod(image_features.cells, columns)
+
+        def match_cell(cell):
+            reference_indices = np.flatnonzero(reference_features.cells == cell)
+            row, column = divmod(cell, columns)
+            image_indices = np.flatnonzero((np.abs(image_rows - row) <= 1) & (np.abs(image_columns - column) <= 1))
+            if len(reference_indices) == 0 or len(image_indices) == 0:
+                return None
+
+            cell_reference, cell_image, distances = \
+                AlignORB.match_descriptors(reference_features.descriptors[reference_indices],
+                                           image_features.descriptors[image_indices])
+
+            return reference_indices[cell_reference], image_indices[cell_image], distances
+
+        cells = range(rows * columns)
+        if DETECTION_THREADS <= 1:
+            cells_matches = list(map(match_cell, cells))
+        else:
+            with ThreadPoolExecutor(max_workers=DETECTION_THREADS) as executor:
+                cells_matches = list(executor.map(match_cell, cells))
+
+        cells_matches = [matches for matches in cells_matches if matches is not None]
+        if len(cells_matches) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+        return tuple(np.concatenate(arrays) for arrays in zip(*cells_matches))
+
+    @staticmethod
+    def match_descriptors(reference_descriptors, image_descriptors) -> tuple:
+        """
+        Matches the reference descriptors with the image descriptors, with the matcher chosen by MATCHER. The brute
+        force matches are pruned to the best GOOD_MATCH_PERCENT, while the cross check and the ratio test already
+        discard the ambiguous matches.
+        :param reference_descriptors: The descriptors of the reference.
+        :param image_descriptors: The descriptors of the image.
+        :return: The indices of the reference features, the indices of the image features and the match distances.
+        """
+        if MATCHER == CROSSCHECK_MATCHER:
+            matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+            return AlignORB.matches_to_arrays(matcher.match(reference_descriptors, image_descriptors))
+
+        if MATCHER == FLANN_MATCHER:
+            return AlignORB.flann_match(reference_descriptors, image_descriptors)
+
+        matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
+        matches = matcher.match(reference_descriptors, image_descriptors)
+
+        return AlignORB.prune_low_score_matches(*AlignORB.matches_to_arrays(matches))
 
     @staticmethod
-    def prune_low_score_matches(matches):
+    def flann_match(reference_descriptors, image_descriptors) -> tuple:
+        """
+        Finds the two approximate nearest neighbours of each reference descriptor in a LSH index of the image
+        descriptors, and keeps the match if it passes Lowe's ratio test.
+        :param reference_descriptors: The descriptors of the reference.
+        :param image_descriptors: The descriptors of the image.
+        :return: The indices of the reference features, the indices of the image features and the match distances.
+        """
+        index_parameters = dict(algorithm=6,  # FLANN_INDEX_LSH
+                                table_number=FLANN_LSH_TABLES,
+                                key_size=FLANN_LSH_KEY_SIZE,
+                                multi_probe_level=FLANN_LSH_PROBE_LEVEL)
+        matcher = cv2.FlannBasedMatcher(index_parameters, dict(checks=FLANN_CHECKS))
+        neighbours = matcher.knnMatch(reference_descriptors, image_descriptors, k=2)
+
+        # the index can return less than two neighbours; a single neighbour has nothing to be compared to
+        matches = [pair[0] for pair in neighbours
+                   if len(pair) == 2 and pair[0].distance < RATIO_TEST * pair[1].distance]
+
+        return AlignORB.matches_to_arrays(matches)
+
+    @staticmethod
+    def prune_low_score_matches(reference_indices, image_indices, distances) -> tuple:
         """
         Prune low score matches in order to get feature which were as close to straight lines as possible.
-        :param matches:
-        :return:
+        :param reference_indices: The indices of the matched reference features.
+        :param image_indices: The indices of the matched image features.
+        :param distances: The match distances.
+        :return: The three arrays, keeping only the best matches, best first.
         """
-        # best matches first
-        matches.sort(key=lambda x: x.distance, reverse=False)
+        # best matches first; the stable sort keeps the matcher order for equal distances
+        order = np.argsort(distances, kind='stable')
 
         # remove matches with low score
-        numGoodMatches = int(len(matches) * GOOD_MATCH_PERCENT)
-        matches = matches[:numGoodMatches]
+        numGoodMatches = int(len(order) * GOOD_MATCH_PERCENT)
+        order = order[:numGoodMatches]
 
-        return matches
+        return reference_indices[order], image_indices[order], distances[order]
 
     def get_align_affine_transformation(self):
         """
+        Creates the affine matrix which aligns the input with the reference, according to the alignment mode, and
+        validates it. The valid affine is refined with ECC if ECC_REFINE is set; if there is no valid affine, the
+        alignment falls back on ECC alone if ECC_FALLBACK is set.
+        :return: The valid affine matrix, or None if the alignment failed.
+        """
+        if ALIGNMENT_MODE == CASCADE_MODE:
+            affine = self.get_cascade_affine_transformation()
+        else:
+            if ALIGNMENT_MODE == PYRAMID_MODE:
+                affine = self.get_pyramid_affine_transformation()
+            else:
+                affine = self.get_feature_affine_transformation(self.align_input, self.align_reference)
+
+            if affine is not None and self.validate_transform(affine):
+                self.tier = ALIGNMENT_MODE
+            else:
+                affine = None
+
+        if affine is not None:
+            if ECC_REFINE:
+                refined = self.get_ecc_affine_transformation(affine, coarsest_factor=ECC_REFINE_FACTOR)
+                if refined is not None and self.validate_transform(refined):
+                    affine = refined
+            return affine
+
+        if not ECC_FALLBACK:
+            return None
+
+        print(yellow("[ INFO ] ") + yellow("No valid feature alignment, falling back on ECC."))
+        affine = self.get_ecc_affine_transformation()
+        if affine is None or not self.validate_transform(affine):
+            return None
+
+        self.tier = ECC_TIER
+        return affine
+
+    def get_cascade_affine_transformation(self):
+        """
+        Tries the alignment tiers from the cheapest to the most expensive, and stops at the first valid affine: the
+        phase correlation, which finds the translation of the scene, then ORB with CASCADE_SMALL_FEATURES feature
+        points, at most MAX_FEATURES, then ORB with MAX_FEATURES. The small ORB tier is skipped when the cap makes it
+        the same as the last one. The tier which succeeded is kept in self.tier.
+        :return: The valid affine matrix, or None if no tier succeeded.
+        """
+        small_features = min(CASCADE_SMALL_FEATURES, MAX_FEATURES)
+        tiers = [(PHASE_TIER, self.get_phase_affine_transformation)]
+        if small_features < MAX_FEATURES:
+            tiers.append((SMALL_ORB_TIER, lambda: self.get_feature_affine_transformation(
+                self.align_input, self.align_reference, max_features=small_features)))
+        tiers.append((ORB_MODE, lambda: self.get_feature_affine_transformation(self.align_input, self.align_reference)))
+
+        for tier, estimate in tiers:
+            affine = estimate()
+            if affine is not None and self.validate_transform(affine):
+                self.tier = tier
+                return affine
+
+        return None
+
+    def get_phase_affine_transformation(self):
+        """
+        Finds the translation of the input with the phase correlation of the green bands, on the PHASE_FACTOR level.
+        The bands are cropped to their common size and weighted with a Hanning window against the edge effects.
+        :return: The full resolution translation affine matrix, or None if the correlation peak is weaker than
+        PHASE_MIN_RESPONSE.
+        """
+        input_level = self.pyramid_level(self.align_input, PHASE_FACTOR).green_numpy
+        reference_level = self.pyramid_level(self.align_reference, PHASE_FACTOR).green_numpy
+
+        height = min(input_level.shape[0], reference_level.shape[0])
+        width = min(input_level.shape[1], reference_level.shape[1])
+        window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+
+        (shift_x, shift_y), response = cv2.phaseCorrelate(input_level[:height, :width].astype(np.float32),
+                                                          reference_level[:height, :width].astype(np.float32),
+                                                          window)
+        if DIAGNOSTICS:
+            print("Phase correlation shift", (shift_x, shift_y), "response", response)
+
+        if response < PHASE_MIN_RESPONSE:
+            return None
+
+        affine = np.array([[1, 0, shift_x], [0, 1, shift_y]], dtype=np.float64)
+        return self.level_to_full_affine(affine, PHASE_FACTOR)
+
+    def get_ecc_affine_transformation(self, affine=None, coarsest_factor=None):
+        """
+        Estimates the affine matrix with ECC on the green band, coarse to fine, from the coarsest_factor level to the
+        ECC_FINEST_FACTOR level, each level starting from the estimate of the previous one. Without an initial affine,
+        the coarsest level only estimates a translation, since the scenes of a path_row are close to aligned.
+        :param affine: The full resolution affine matrix to start from, None for the identity.
+        :param coarsest_factor: The downscale factor of the first level, a power of 2, ECC_COARSEST_FACTOR if None.
+        :return: The full resolution affine matrix, or None if ECC failed on a level.
+        """
+        factor = ECC_COARSEST_FACTOR if coarsest_factor is None else coarsest_factor
+        while factor >= ECC_FINEST_FACTOR:
+            input_level = self.pyramid_level(self.align_input, factor)
+            reference_level = self.pyramid_level(self.align_reference, factor)
+
+            if affine is None:
+                align = ecc.Align(reference_level.green_numpy, input_level.green_numpy,
+                                  warp_mode=cv2.MOTION_TRANSLATION)
+                level_affine = align.find_matches()
+            else:
+                align = ecc.Align(reference_level.green_numpy, input_level.green_numpy)
+                level_affine = align.find_matches(self.full_to_level_affine(affine, factor))
+
+            if level_affine is None:
+                return None
+            affine = self.level_to_full_affine(level_affine, factor)
+
+            if DIAGNOSTICS:
+                print("ECC level", factor, "correlation", align.correlation)
+
+            factor //= 2
+
+        return affine
+
+    def get_pyramid_affine_transformation(self):
+        """
+        Coarse to fine alignment. The affine matrix is estimated from the features of the coarsest pyramid level, then
+        refined on each finer level by searching reference patches in a small window around the position predicted by
+        the current estimate, up to the full resolution.
+        :return: The full resolution affine matrix, or None if the coarse level could not be aligned.
+        """
+        input_level = self.pyramid_level(self.align_input, PYRAMID_FACTOR)
+        reference_level = self.pyramid_level(self.align_reference, PYRAMID_FACTOR)
+
+        affine = self.get_feature_affine_transformation(input_level, reference_level,
+                                                        distance=EUCLIDIAN_DISTANCE / PYRAMID_FACTOR)
+        if affine is None:
+            return None
+        affine = self.level_to_full_affine(affine, PYRAMID_FACTOR)
+
+        factor = PYRAMID_FACTOR // 2
+        while factor >= 1:
+            input_level = self.pyramid_level(self.align_input, factor)
+            reference_level = self.pyramid_level(self.align_reference, factor)
+
+            level_affine = self.refine_affine(self.full_to_level_affine(affine, factor), input_level, reference_level)
+            affine = self.level_to_full_affine(level_affine, factor)
+
+            factor //= 2
+
+        return affine
+
+    def refine_affine(self, affine, input_8bit: sc.NumpyScene, reference_8bit: sc.NumpyScene) -> np.ndarray:
+        """
+        Refines an affine matrix on one pyramid level, with the patch correspondences of both bands. If there are not
+        enough correspondences, the estimate is kept.
+        :param affine: The current affine matrix, on this level.
+        :param input_8bit: The input NumpyScene of this level.
+        :param reference_8bit: The reference NumpyScene of this level.
+        :return: The refined affine matrix, on this level.
+        """
+        image_points_green, reference_points_green = self.window_correspondences(affine,
+                                                                                 input_8bit.green_numpy,
+                                                                                 reference_8bit.green_numpy)
+        image_points_swir, reference_points_swir = self.window_correspondences(affine,
+                                                                               input_8bit.swir1_numpy,
+                                                                               reference_8bit.swir1_numpy)
+
+        image_points = np.array(image_points_green + image_points_swir, dtype=np.float32).reshape(-1, 2)
+        reference_points = np.array(reference_points_green + reference_points_swir, dtype=np.float32).reshape(-1, 2)
+
+        if len(image_points) < REFINE_MIN_POINTS:
+            return affine
+
+        refined, inliers = cv2.estimateAffine2D(image_points, reference_points, None, cv2.RANSAC,
+                                                ransacReprojThreshold=REFINE_REPROJECTION_ERROR)
+        if refined is None:
+            return affine
+
+        return refined
+
+    @staticmethod
+    def window_correspondences(affine, image, reference, rows=None, columns=None) -> tuple:
+        """
+        Takes a patch from the center of each reference box and searches it in the image, in a small window around the
+        position predicted by the affine matrix.
+        :param affine: The affine matrix which maps the image to the reference.
+        :param image: The image band.
+        :param reference: The reference band.
+        :param rows: Number of rows of boxes, ROWS_NUMBER if None.
+        :param columns: Number of columns of boxes, COLUMNS_NUMBER if None.
+        :return: The lists of image points and the corresponding reference points.
+        """
+        rows = ROWS_NUMBER if rows is None else rows
+        columns = COLUMNS_NUMBER if columns is None else columns
+        image_points = []
+        reference_points = []
+
+        half = REFINE_PATCH_SIZE // 2
+        inverse = cv2.invertAffineTransform(affine)
+        height, width = reference.shape
+        image_height, image_width = image.shape
+
+        for x in range(0, columns):
+            for y in range(0, rows):
+                center_x = (2 * x + 1) * width // (2 * columns)
+                center_y = (2 * y + 1) * height // (2 * rows)
+                if not (half <= center_x <= width - half and half <= center_y <= height - half):
+                    continue
+
+                patch = reference[center_y - half:center_y + half, center_x - half:center_x + half]
+                mean, deviation = cv2.meanStdDev(patch)
+                if deviation[0, 0] < REFINE_MIN_DEVIATION:
+                    continue
+
+                # the top left corner of the search window in the image
+                predicted_x, predicted_y = inverse.dot((center_x, center_y, 1))
+                x0 = int(round(predicted_x)) - half - REFINE_SEARCH_RADIUS
+                y0 = int(round(predicted_y)) - half - REFINE_SEARCH_RADIUS
+                x1 = x0 + REFINE_PATCH_SIZE + 2 * REFINE_SEARCH_RADIUS
+                y1 = y0 + REFINE_PATCH_SIZE + 2 * REFINE_SEARCH_RADIUS
+                if x0 < 0 or y0 < 0 or x1 > image_width or y1 > image_height:
+                    continue
+
+                scores = cv2.matchTemplate(image[y0:y1, x0:x1], patch, cv2.TM_CCOEFF_NORMED)
+                min_score, max_score, min_location, max_location = cv2.minMaxLoc(scores)
+                if max_score < REFINE_MIN_SCORE:
+                    continue
+
+                image_points.append((x0 + max_location[0] + half, y0 + max_location[1] + half))
+                reference_points.append((center_x, center_y))
+
+        return image_points, reference_points
+
+    def get_feature_affine_transformation(self, input_8bit: sc.NumpyScene, reference_8bit: sc.NumpyScene,
+                                          distance=None, max_features=None):
+        """
         The main aligning method. Find the feature key points in each image by splitting the image in boxes, so that the
         features are evenly distributed across the whole image, avoiding clusters of points in just one region, which
         would create a bad affine matrix. Sorts the matches based on their score, and prunes the ones which are not
         euclidean distance valid, which indicates that the feature is not correct. Creates the affine matrix and inliers
-        based on the pruned key points from the reference image and current comparison matrix, and validates the
-        transformation matrix. With the valid affine matrix, it warps it to the current image.
-        :return: Returns the result of validating the affine matrix and the pruned matches image for writing it to the
-        disk.
+        based on the pruned key points from the reference image and current comparison matrix.
+        :param input_8bit: The input on the detection level.
+        :param reference_8bit: The reference on the detection level, which the reference features were computed on.
+        :param distance: The allowed euclidean distance between matched points, on the detection level,
+        EUCLIDIAN_DISTANCE if None.
+        :param max_features: The number of feature points of each band, MAX_FEATURES if None; the strongest reference
+        points of each box are used for a smaller number than MAX_FEATURES.
+        :return: Returns the affine matrix on the detection level, or None if it could not be created.
         """
+        distance = EUCLIDIAN_DISTANCE if distance is None else distance
+        max_features = MAX_FEATURES if max_features is None else max_features
 
         # detect and compute the feature points by splitting the image in boxes for good feature spread
-        keypoints_img_green, descriptors_img_green = self.box_detect_and_compute(self.align_input.green_numpy)
-        keypoints_img_swir, descriptors_img_swir = self.box_detect_and_compute(self.align_input.swir1_numpy)
-        keypoints_ref_green, descriptors_ref_green = self.box_detect_and_compute(self.align_reference.green_numpy)
-        keypoints_ref_swir, descriptors_ref_swir = self.box_detect_and_compute(self.align_reference.swir1_numpy)
+        patch_size, levels = self.detection_orb_parameters()
+        features_img_green, features_img_swir = \
+            self.box_detect_and_compute_all([input_8bit.green_numpy, input_8bit.swir1_numpy],
+                                            patch_size=patch_size, levels=levels, max_features=max_features)
 
-        keypoints_img_all = keypoints_img_green + keypoints_img_swir
-        keypoints_ref_all = keypoints_ref_green + keypoints_ref_swir
+        reference_green, reference_swir = self.reference_features.green, self.reference_features.swir
+        if max_features < MAX_FEATURES:
+            budget = max_features // ROWS_NUMBER // COLUMNS_NUMBER
+            reference_green = reference_green.select_best_per_cell(budget)
+            reference_swir = reference_swir.select_best_per_cell(budget)
 
-        if len(keypoints_img_all) == 0 or len(keypoints_ref_all) == 0:
-            print(red("There are no keypoints found."))
-            return None
+        features_img_all = fe.Features.concatenate([features_img_green, features_img_swir])
+        features_ref_all = fe.Features.concatenate([reference_green, reference_swir])
 
-        try:
-            descriptors_img_all = np.concatenate((descriptors_img_green, descriptors_img_swir), axis=0)
-            descriptors_ref_all = np.concatenate((descriptors_ref_green, descriptors_ref_swir), axis=0)
-        except ValueError:
-            print(red("The imaged are zero valued."))
+        if len(features_img_all) == 0 or len(features_ref_all) == 0:
+            print(red("There are no keypoints found."))
             return None
 
-        matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
-        matches = matcher.match(descriptors_ref_all, descriptors_img_all)
-
-        matches = self.prune_low_score_matches(matches)
+        # a green descriptor is only compared with green descriptors, a swir descriptor with swir descriptors
+        reference_indices, image_indices, distances = \
+            self.match_bands([reference_green, reference_swir],
+                             [features_img_green, features_img_swir])
 
         reference_points, image_points, pruned_matches_image = \
-            self.prune_matches_by_distance(matches, keypoints_ref_all, keypoints_img_all)
+            self.prune_matches_by_distance(reference_indices, image_indices, distances,
+                                           features_ref_all, features_img_all,
+                                           reference_8bit=reference_8bit, input_8bit=input_8bit, distance=distance)
 
-        sc.DISPLAY.image("MATCHES", pruned_matches_image)
+        if pruned_matches_image is not None:
+            sc.DISPLAY.image("MATCHES", pruned_matches_image)
+            self.write_diagnostics_image("matches", pruned_matches_image)
 
         # create the affine transformation matrix and inliers
         try:
@@ -302,30 +1228,63 @@ class AlignORB:
             print(red("Image is corrupt. Not writing."))
             return None
 
-        # check application mode
-        if DEBUG_OUTLIERS:
-            self.affine_creation_debug_on(inliers, reference_points, image_points)
-        if affine is None:
-            return None
-
-        if not self.validate_transform(affine):
-            return None
+        # check application mode; estimateAffine2D gives no inliers when it finds no affine
+        if (DEBUG_OUTLIERS or DIAGNOSTICS) and inliers is not None:
+            self.affine_creation_debug_on(inliers=inliers, image_points=image_points,
+                                          reference_points=reference_points)
 
         return affine
 
     def align(self):
-
+        """
+        Aligns the input with the reference.
+        :return: The warped scene, or None if the alignment failed.
+        """
         affine = self.get_align_affine_transformation()
         if affine is None:
             return None
 
-        # warp the affine matrix to the current image
-        height, width = self.reference_img.green_numpy.shape
-        aligned_result_green = cv2.warpAffine(self.input_img.green_numpy, affine, (width, height))
-        aligned_result_swir = cv2.warpAffine(self.input_img.swir1_numpy, affine, (width, height))
+        return self.warp(affine)
+
+    def warp(self, affine):
+        """
+        Warps the bands of the input, and its NDSI if it has one, onto the reference. Stacked bands are warped into a
+        single new stack.
+        :param affine: The affine matrix which aligns the input with the reference.
+        :return: The warped scene.
+        """
+        height, width = self.align_reference.green_numpy.shape
+        return AlignORB.warp_scene(self.input_img, affine, (width, height))
+
+    @staticmethod
+    def warp_scene(input_img, affine, size):
+        """
+        Warps the bands of a scene, and its NDSI if it has one, with the given affine matrix. The bands of a stacked
+        scene are warped one at a time into the planes of a new stack.
+        :param input_img: The scene.
+        :param affine: The affine matrix which aligns the scene with the reference.
+        :param size: The width and height of the reference.
+        :return: The warped scene.
+        """
+        width, height = size
+        if isinstance(input_img, sc.StackedScene):
+            aligned_stack = sc.StackedScene.empty_stack((height, width), input_img.stack.dtype)
+            for band in range(len(aligned_stack)):
+                cv2.warpAffine(input_img.stack[band], affine, (width, height), dst=aligned_stack[band])
+            if isinstance(input_img, sc.StackedSceneWithNDSI):
+                aligned_result_ndsi = sc.NumpySceneWithNDSI.warp_ndsi(input_img.ndsi, affine, (width, height))
+                aligned = sc.StackedSceneWithNDSI(aligned_stack, aligned_result_ndsi)
+            else:
+                aligned = sc.StackedScene(aligned_stack)
+
+            sc.DISPLAY.numpy_scene("OUTPUT", aligned)
+            return aligned
 
-        if isinstance(self.input_img, sc.NumpySceneWithNDSI):
-            aligned_result_ndsi = cv2.warpAffine(self.input_img.ndsi, affine, (width, height))
+        aligned_result_green = cv2.warpAffine(input_img.green_numpy, affine, (width, height))
+        aligned_result_swir = cv2.warpAffine(input_img.swir1_numpy, affine, (width, height))
+
+        if isinstance(input_img, sc.NumpySceneWithNDSI):
+            aligned_result_ndsi = sc.NumpySceneWithNDSI.warp_ndsi(input_img.ndsi, affine, (width, height))
             aligned = sc.NumpySceneWithNDSI(aligned_result_green, aligned_result_swir, aligned_result_ndsi)
         else:
             aligned = sc.NumpyScene(aligned_result_green, aligned_result_swir)
@@ -352,69 +1311,86 @@ class AlignORB:
                   "  x  ", reference_point[0] - image_point[0],
                   "  y  ", reference_point[1] - image_point[1])
 
-    def prune_matches_by_distance(self, matches, reference_keypoints, image_keypoints):
+    def prune_matches_by_distance(self, reference_indices, image_indices, distances,
+                                  reference_features: fe.Features, image_features: fe.Features,
+                                  reference_8bit=None, input_8bit=None, distance=None):
         """
         Method which prunes the feature points pairs which are not valid (too far away from each other in the euclidean
         distance. This ensures that the remaining feature points are valid matches and the match line as straight as
-        possible, which would be a 1 to 1 match.
-        :param matches: The matches pairs
-        :param reference_keypoints: Total keypoints from the reference image
-        :param image_keypoints: Total keypoints from the current comparison image
+        possible, which would be a 1 to 1 match. The pruning is done on all the matches at once.
+        :param reference_indices: The indices of the matched reference features.
+        :param image_indices: The indices of the matched image features.
+        :param distances: The match distances.
+        :param reference_features: Total features from the reference image
+        :param image_features: Total features from the current comparison image
+        :param reference_8bit: The reference the keypoints were detected on, for drawing the matches.
+        :param input_8bit: The image the keypoints were detected on, for drawing the matches.
+        :param distance: The allowed euclidean distance, EUCLIDIAN_DISTANCE if None.
         :return: Returns the reference and current image keypoint pairs which were left after the pruning, as well as
-        the pruned matches cv2 image.
+        the pruned matches cv2 image, which is only drawn in diagnostics or display mode and is None otherwise.
         """
-        # go through point matches and prune the bad results
-        matches_pruned = []
-        reference_points = []
-        image_points = []
+        reference_points = reference_features.points[reference_indices]
+        image_points = image_features.points[image_indices]
 
-        for match in matches:
-            reference_point = reference_keypoints[match.queryIdx].pt
-            image_point = image_keypoints[match.trainIdx].pt
+        valid = self.validate_euclidean_distance(reference_point=reference_points,
+                                                 image_point=image_points,
+                                                 distance=distance)
+        reference_points = reference_points[valid]
+        image_points = image_points[valid]
 
-            valid_euclidean_distance = self.validate_euclidean_distance(reference_point=reference_point,
-                                                                        image_point=image_point)
-            if valid_euclidean_distance:
-                reference_points.append(reference_point)
-                image_points.append(image_point)
-                matches_pruned.append(match)
+        if not (DIAGNOSTICS or sc.DISPLAY.do_it):
+            return reference_points, image_points, None
 
-        # convert them into numpy arrays for creating the alignment
-        reference_points = np.array(reference_points)
-        image_points = np.array(image_points)
+        if reference_8bit is None:
+            reference_8bit = self.align_reference
+        if input_8bit is None:
+            input_8bit = self.align_input
+
+        matches_pruned = [cv2.DMatch(int(reference_index), int(image_index), float(match_distance))
+                          for reference_index, image_index, match_distance
+                          in zip(reference_indices[valid], image_indices[valid], distances[valid])]
 
         # draw the match image
-        pruned_matches_image = cv2.drawMatches(self.align_reference.green_numpy, reference_keypoints,
-                                               self.align_input.green_numpy, image_keypoints,
+        pruned_matches_image = cv2.drawMatches(reference_8bit.green_numpy, reference_features.to_keypoints(),
+                                               input_8bit.green_numpy, image_features.to_keypoints(),
                                                matches_pruned,
                                                None, matchColor=(0, 255, 255), singlePointColor=(100, 0, 0),
                                                flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
 
         return reference_points, image_points, pruned_matches_image
 
+    def write_diagnostics_image(self, suffix, image) -> None:
+        """
+        Writes a diagnostics image, if the diagnostics mode has an output directory.
+        :param suffix: The suffix of the file name, after the scene name.
+        :param image: The cv2 image.
+        :return: None
+        """
+        if not DIAGNOSTICS or DIAGNOSTICS_DIR is None:
+            return
+
+        os.makedirs(DIAGNOSTICS_DIR, exist_ok=True)
+        cv2.imwrite(os.path.join(DIAGNOSTICS_DIR, self.name + "_" + suffix + ".png"), image)
+
     @staticmethod
-    def validate_euclidean_distance(reference_point, image_point) -> bool:
+    def validate_euclidean_distance(reference_point, image_point, distance=None) -> bool:
         """
         Calculates the difference between the reference and image coordinates. If the euclidean difference is too big,
         that means that the feature points are not correctly matched. If correctly matched, the distance should be as
         small as possible, and the match should be a straight line. The euclidean distance comparison allows the degree
         of match misalignment.
-        :param reference_point: A 2D point with the coordinates of a feature point from the reference
-        :param image_point: A 2D point with the coordinates of a feature point from the current image
+        :param reference_point: A 2D point with the coordinates of a feature point from the reference, or an array of
+        shape (N, 2) of such points
+        :param image_point: A 2D point with the coordinates of a feature point from the current image, or an array of
+        shape (N, 2) of such points
+        :param distance: The allowed distance on each axis, EUCLIDIAN_DISTANCE if None.
         :return: If the distance is smaller than the allowed euclidean distance, returns True, else, the match is not
-        valid and returns False
+        valid and returns False; for arrays of points, a boolean array with the result of each pair
         """
-        # coordinates of the keypoints for calculating the euclidean distance
-        reference_x = reference_point[0]
-        reference_y = reference_point[1]
-        image_x = image_point[0]
-        image_y = image_point[1]
-
+        distance = EUCLIDIAN_DISTANCE if distance is None else distance
         # check if the distance between the points is valid to ensure that the match line is as straight as possible
-        if (abs(reference_x - image_x) < EUCLIDIAN_DISTANCE) and (abs(reference_y - image_y) < EUCLIDIAN_DISTANCE):
-            return True
-        else:
-            return False
+        difference = np.abs(np.subtract(reference_point, image_point))
+        return np.all(difference < distance, axis=-1)
 
     def validate_transform(self, transform):
         """
@@ -433,7 +1409,7 @@ class AlignORB:
         difference = np.absolute(np.subtract(identity, transform))
         compare = self.create_comparison_matrix(height, width)
 
-        if DEBUG_TRANSFORM_MATRIX:
+        if DEBUG_TRANSFORM_MATRIX or DIAGNOSTICS:
             print("Transform \n", transform)
             print("Difference \n", difference)
             print("Comparison \n", compare)
@@ -460,33 +1436,107 @@ class AlignORB:
         return comparison
 
 
-if __name__ == "__main__":
+def load_profile(profile_path) -> bool:
     """
-    Handle multi process.
+    Sets the alignment settings to the parameters of a tuning profile. Only the PROFILE_PARAMETERS are set.
+    :param profile_path: Path to the json profile written by the tuning.
+    :return: True if the profile was loaded.
     """
+    try:
+        with open(profile_path) as profile_file:
+            parameters = json.load(profile_file)['parameters']
+    except (OSError, KeyError, TypeError, ValueError):
+        print(red("[ ERROR ] ") + "Cannot read the alignment profile " + profile_path)
+        return False
 
-    # profiler for execution data gathering
-    pr = cProfile.Profile()
-    pr.enable()
+    for name, value in parameters.items():
+        if name in PROFILE_PARAMETERS:
+            globals()[name] = value
 
-    VALID = True
+    return True
+
+
+# the profile is applied to every alignment process, including the ones started by the processing
+if os.path.isfile(definitions.ALIGNMENT_PROFILE_PATH):
+    load_profile(definitions.ALIGNMENT_PROFILE_PATH)
 
-    scene = sc.PathScene(sys.argv[1], sys.argv[2])
-    reference_scene = sc.PathScene(sys.argv[3], sys.argv[4])
-    aligned_scene = sc.PathScene(sys.argv[5], sys.argv[6])
 
+def align_scene(scene, reference_scene, aligned_scene, output_mode=definitions.DEFAULT_OUTPUT_MODE) -> int:
+    """
+    Calculates the NDSI of the scene, aligns it with the reference and writes the result, then reports the peak
+    memory of the scene. In the memory budget mode the NDSI written with the raster output is streamed from the
+    written aligned bands, instead of being carried through the alignment and warped.
+    :param scene: The PathScene which will be aligned.
+    :param reference_scene: The PathScene of the reference.
+    :param aligned_scene: The PathScene in which the result is written.
+    :param output_mode: Whether the warped images or only the transform of the scene are written.
+    :return: The return code: 0 if the scene was aligned, 1 otherwise.
+    """
     print(yellow("[ INFO ] ") + magenta("Aligning scene: ") + magenta(scene.get_scene_name()))
+    # a pool worker runs many scenes, so the peak is measured from the start of this one
+    memory.reset_peak_rss()
+
     process = ProcessImage(scene=scene,
                            reference_scene=reference_scene,
-                           aligned_scene=aligned_scene)
+                           aligned_scene=aligned_scene,
+                           output_mode=output_mode)
 
-    ndsi_image = process.ndsi()
+    process.ndsi()
     aligned_image = process.align()
 
     if aligned_image is None:
-        VALID = False
+        return_code = 1
     else:
         process.write()
+        if MEMORY_BUDGET and output_mode == definitions.RASTER_OUTPUT:
+            # the aligned bands are on the disk, so they are released and read back a strip at a time
+            aligned_image = None
+            process.stream_ndsi()
+        return_code = 0
+
+    peak_rss = memory.get_peak_rss()
+    if peak_rss is not None:
+        print(yellow("[ INFO ] ") + "Peak memory of " + scene.get_scene_name() + ": " +
+              str(peak_rss // (1 << 20)) + " MB")
+
+    return return_code
+
+
+def align_scene_task(scene, reference_scene, aligned_scene, output_mode=definitions.DEFAULT_OUTPUT_MODE) -> int:
+    """
+    Entry point of the alignment for the worker pool. The processing exits with sys.exit on errors, which would kill
+    the worker, so the exit is turned into the return code of the task.
+    :param scene: The PathScene which will be aligned.
+    :param reference_scene: The PathScene of the reference.
+    :param aligned_scene: The PathScene in which the result is written.
+    :param output_mode: Whether the warped images or only the transform of the scene are written.
+    :return: The return code of the alignment.
+    """
+    try:
+        return align_scene(scene=scene, reference_scene=reference_scene, aligned_scene=aligned_scene,
+                           output_mode=output_mode)
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code
+
+
+if __name__ == "__main__":
+    """
+    Handle multi process.
+    """
+
+    # profiler for execution data gathering
+    pr = cProfile.Profile()
+    pr.enable()
+
+    scene = sc.PathScene(sys.argv[1], sys.argv[2])
+    reference_scene = sc.PathScene(sys.argv[3], sys.argv[4])
+    aligned_scene = sc.PathScene(sys.argv[5], sys.argv[6])
+    output_mode = sys.argv[7] if len(sys.argv) > 7 else definitions.DEFAULT_OUTPUT_MODE
+
+    return_code = align_scene(scene=scene, reference_scene=reference_scene, aligned_scene=aligned_scene,
+                              output_mode=output_mode)
 
     #  stop profiler
     pr.disable()
@@ -498,7 +1548,4 @@ if __name__ == "__main__":
     print(s.getvalue())
     sc.DISPLAY.wait()
 
-    if VALID:
-        sys.exit(0)
-    else:
-        sys.exit(1)
+    sys.exit(return_code)
@@ -0,0 +1,210 @@
+"""
+Module which benchmarks the descriptor matchers of the ORB alignment on synthetic scene pairs with a known affine
+transformation, created from real bands.
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(sys.path[0] + '/..')
+import definitions
+from data_processing import alignment_ORB as al
+from data_processing import scenes as sc
+
+from colors import *
+
+PAIRS_PER_SEED = 5  # the number of synthetic pairs created from a seed scene
+MARGIN = 200  # the pixels cropped from each side of the seed, so that the shifted image has no empty border
+MAX_SHIFT = 60  # the maximal synthetic translation, in pixels
+MAX_ANGLE = 0.3  # the maximal synthetic rotation, in degrees, inside the ALLOWED_ROTATION of the alignment
+NOISE = 300  # the standard deviation of the noise added to the image, in 16 bit levels
+ALLOWED_ERROR = 2.0  # the maximal corner displacement, in pixels, of a successful alignment
+# the alignment settings during the measurements: ORB alone, so that an ECC fallback or refinement is not counted as the
+# success, the time or the error of the matcher or configuration under test
+MEASURED_SETTINGS = {
+    'ALIGNMENT_MODE': al.ORB_MODE,
+    'ECC_FALLBACK': False,
+    'ECC_REFINE': False
+}
+
+
+def apply_settings(settings) -> dict:
+    """
+    Sets alignment settings.
+    :param settings: Dictionary with the alignment setting names as keys.
+    :return: The previous values of the settings, for restoring them with apply_settings.
+    """
+    initial = {name: getattr(al, name) for name in settings}
+    for name, value in settings.items():
+        setattr(al, name, value)
+
+    return initial
+
+
+def read_seed(green_path, swir1_path=None) -> sc.NumpyScene:
+    """
+    Reads the bands of a seed scene. When the swir1 band is missing, the green band is used for both bands.
+    :param green_path: Path to the green band.
+    :param swir1_path: Path to the swir1 band.
+    :return: sc.NumpyScene
+    """
+    if swir1_path is None or not os.path.isfile(swir1_path):
+        swir1_path = green_path
+
+    return sc.NumpyScene.read(sc.PathScene(green_path, swir1_path))
+
+
+def make_synthetic_pairs(seed: sc.NumpyScene, count=PAIRS_PER_SEED, random_seed=0):
+    """
+    Creates pairs of scenes with a known affine transformation from a seed scene. The reference is the seed cropped by
+    MARGIN pixels; the image is the seed warped by a random small rotation and translation, with added noise.
+    :param seed: The 16 bit seed scene.
+    :param count: The number of pairs.
+    :param random_seed: The seed of the random generator, so that the pairs are the same between runs.
+    :return: Generator of (image, reference, affine) tuples, where the affine maps the image to the reference.
+    """
+    random = np.random.default_rng(random_seed)
+    height, width = seed.green_numpy.shape
+    size = (width - 2 * MARGIN, height - 2 * MARGIN)
+
+    reference = sc.NumpyScene(seed.green_numpy[MARGIN:-MARGIN, MARGIN:-MARGIN],
+                              seed.swir1_numpy[MARGIN:-MARGIN, MARGIN:-MARGIN])
+
+    for index in range(count):
+        angle = random.uniform(-MAX_ANGLE, MAX_ANGLE)
+        shift_x, shift_y = random.uniform(-MAX_SHIFT, MAX_SHIFT, 2)
+
+        # maps the image coordinates to the seed coordinates
+        to_seed = cv2.getRotationMatrix2D((size[0] / 2, size[1] / 2), angle, 1.0)
+        to_seed[:, 2] += (MARGIN + shift_x, MARGIN + shift_y)
+
+        green = cv2.warpAffine(seed.green_numpy, to_seed, size, flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP)
+        swir = cv2.warpAffine(seed.swir1_numpy, to_seed, size, flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP)
+        image = sc.NumpyScene(add_noise(green, random), add_noise(swir, random))
+
+        # the reference pixel y is the seed pixel y + MARGIN
+        affine = to_seed.copy()
+        affine[:, 2] -= MARGIN
+
+        yield image, reference, affine
+
+
+def add_noise(band, random) -> np.ndarray:
+    """
+    Adds gaussian noise to a 16 bit band, keeping the zero border at zero.
+    :param band: The 16 bit band.
+    :param random: The random generator.
+    :return: np.ndarray
+    """
+    noisy = band + random.normal(0, NOISE, band.shape)
+    noisy = np.clip(noisy, 1, (1 << 16) - 1)
+    noisy[band == 0] = 0
+
+    return noisy.astype(np.uint16)
+
+
+def transform_error(affine, truth, width, height) -> float:
+    """
+    Returns the largest distance between the image corners mapped with the estimated and with the true affine.
+    :param affine: The estimated 2x3 affine matrix.
+    :param truth: The true 2x3 affine matrix.
+    :param width: The width of the image.
+    :param height: The height of the image.
+    :return: float
+    """
+    corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]], dtype=np.float64)
+    difference = corners.dot(affine.T) - corners.dot(truth.T)
+
+    return float(np.max(np.linalg.norm(difference, axis=1)))
+
+
+class MatcherBenchmark:
+    """
+    Class which aligns the same synthetic pairs with each descriptor matcher, measuring the alignment time, the success
+    rate and the transform error.
+    """
+
+    def __init__(self, seed_paths, matchers=al.MATCHERS, pairs_per_seed=PAIRS_PER_SEED):
+        """
+        Initializes the benchmark.
+        :param seed_paths: List of (green path, swir1 path) tuples of the seed scenes.
+        :param matchers: The matchers which are compared.
+        :param pairs_per_seed: The number of synthetic pairs created from each seed.
+        """
+        self.seed_paths = seed_paths
+        self.matchers = matchers
+        self.pairs_per_seed = pairs_per_seed
+
+    def start(self) -> dict:
+        """
+        Runs the benchmark and prints the results.
+        :return: Dictionary with the matcher as key and its lists of times, successes and errors as value.
+        """
+        results = {matcher: {'times': [], 'successes': [], 'errors': []} for matcher in self.matchers}
+        initial = apply_settings(dict(MEASURED_SETTINGS, MATCHER=al.MATCHER))
+
+        try:
+            for green_path, swir1_path in self.seed_paths:
+                print(definitions.PRINT_CODES[0] + "Seed: " + green_path)
+                seed = read_seed(green_path, swir1_path)
+
+                for image, reference, truth in make_synthetic_pairs(seed, self.pairs_per_seed):
+                    # the reference is described once, its cost is the same for all the matchers
+                    reference_features = al.AlignORB.describe_reference(reference)
+                    height, width = image.green_numpy.shape
+
+                    for matcher in self.matchers:
+                        al.MATCHER = matcher
+                        start = time.perf_counter()
+                        affine = al.AlignORB(image,
+                                             reference_features=reference_features).get_align_affine_transformation()
+                        results[matcher]['times'].append(time.perf_counter() - start)
+
+                        if affine is None:
+                            results[matcher]['successes'].append(False)
+                            continue
+
+                        error = transform_error(affine, truth, width, height)
+                        results[matcher]['errors'].append(error)
+                        results[matcher]['successes'].append(error <= ALLOWED_ERROR)
+        finally:
+            apply_settings(initial)
+
+        self.print_results(results)
+
+        return results
+
+    @staticmethod
+    def print_results(results) -> None:
+        """
+        Prints the mean time, the success rate and the median error of each matcher.
+        :param results: The results of the benchmark.
+        :return: None
+        """
+        print(definitions.PRINT_CODES[2] + "MATCHER       MEAN TIME   SUCCESS   MEDIAN ERROR")
+        for matcher, result in results.items():
+            if len(result['times']) == 0:
+                continue
+
+            mean_time = np.mean(result['times'])
+            success_rate = np.mean(result['successes'])
+            median_error = np.median(result['errors']) if len(result['errors']) > 0 else float('nan')
+
+            print(blue("{:<12}  {:>8.2f}s   {:>6.1%}   {:>9.2f}px".format(matcher, mean_time, success_rate,
+                                                                           median_error)))
+
+
+if __name__ == "__main__":
+    """
+    Benchmark the matchers on the green bands given as arguments; the swir1 band is taken from the same directory.
+    """
+    seeds = []
+    for green_band in sys.argv[1:]:
+        swir1_band = green_band.replace(definitions.GREEN_BAND_END, definitions.SWIR1_BAND_END)
+        seeds.append((green_band, swir1_band))
+
+    benchmark = MatcherBenchmark(seeds)
+    benchmark.start()
@@ -0,0 +1,202 @@
+"""
+Module which handles the persistent caches of the processing stage, stored in the path_row output directories.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from filelock import FileLock
+
+import definitions
+from data_processing import scenes as sc, features as fe
+
+REFERENCE_PREFIX = 'reference_'
+TRANSFORM_PREFIX = 'transform_'
+
+
+def file_identity(path) -> list:
+    """
+    Returns the identity of a file, as its absolute path, size and modification time, so that a changed file
+    invalidates the cache entries computed from it.
+    :param path: Path to the file.
+    :return: list
+    """
+    status = os.stat(path)
+    return [os.path.abspath(path), status.st_size, status.st_mtime_ns]
+
+
+def make_key(*items) -> str:
+    """
+    Creates a short hash from json serializable items, used for naming the cache entries.
+    :param items: The items which identify the cache entry.
+    :return: str
+    """
+    serialized = json.dumps(items, sort_keys=True)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()[:16]
+
+
+FEATURE_ARRAYS = ('points', 'responses', 'cells', 'descriptors')
+
+
+class ReferenceFeatures:
+    """
+    Class which holds the 8 bit reference scene together with the features of its bands.
+    """
+
+    def __init__(self, reference_8bit, green: fe.Features, swir: fe.Features):
+        """
+        Initializes the reference features.
+        :param reference_8bit: The normalized 8 bit NumpyScene of the reference.
+        :param green: Features of the green band.
+        :param swir: Features of the swir1 band.
+        """
+        self.reference_8bit = reference_8bit
+        self.green = green
+        self.swir = swir
+
+
+class ReferenceFeatureCache:
+    """
+    Class which stores the reference features of a path_row as a compressed npz file, keyed on the identity of the
+    reference band files and the feature detection parameters, so that the reference is described only once.
+    """
+
+    def __init__(self, output_dir, reference_scene: sc.PathScene, parameters: dict):
+        """
+        Initializes the cache entry path and its lock.
+        :param output_dir: The path_row output directory.
+        :param reference_scene: The PathScene of the reference.
+        :param parameters: The feature detection parameters which influence the cached result.
+        """
+        self.key = make_key(file_identity(reference_scene.green_path),
+                            file_identity(reference_scene.swir1_path),
+                            parameters)
+
+        self.cache_dir = os.path.join(output_dir, definitions.CACHE_DIR)
+        self.cache_path = os.path.join(self.cache_dir,
+                                       REFERENCE_PREFIX + reference_scene.get_scene_name() + "_" + self.key + ".npz")
+        self.lock = FileLock(self.cache_path + ".lock")
+
+    def get(self, compute) -> ReferenceFeatures:
+        """
+        Returns the cached reference features, or computes and stores them if they are not cached yet. The lock makes
+        the concurrent alignment processes wait for the first one to compute the features.
+        :param compute: Function which computes the ReferenceFeatures on a cache miss.
+        :return: ReferenceFeatures
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        with self.lock:
+            features = self.load()
+            if features is None:
+                features = compute()
+                self.store(features)
+
+        return features
+
+    def load(self):
+        """
+        Loads the reference features from the cache file.
+        :return: ReferenceFeatures, or None if the file does not exist or cannot be read.
+        """
+        if not os.path.isfile(self.cache_path):
+            return None
+
+        try:
+            with np.load(self.cache_path) as data:
+                reference_8bit = sc.StackedScene.from_bands(data['green_8bit'], data['swir1_8bit'])
+                green = fe.Features(*[data['green_' + name] for name in FEATURE_ARRAYS])
+                swir = fe.Features(*[data['swir_' + name] for name in FEATURE_ARRAYS])
+                features = ReferenceFeatures(reference_8bit, green, swir)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        return features
+
+    def store(self, features: ReferenceFeatures) -> None:
+        """
+        Writes the reference features to the cache file. The file is written under a temporary name and then renamed,
+        so that a reader never sees a partially written file.
+        :param features: The ReferenceFeatures to store.
+        :return: None
+        """
+        arrays = {
+            'green_8bit': features.reference_8bit.green_numpy,
+            'swir1_8bit': features.reference_8bit.swir1_numpy
+        }
+        for name in FEATURE_ARRAYS:
+            arrays['green_' + name] = getattr(features.green, name)
+            arrays['swir_' + name] = getattr(features.swir, name)
+
+        temporary_path = self.cache_path + ".tmp.npz"
+        np.savez_compressed(temporary_path, **arrays)
+        os.replace(temporary_path, self.cache_path)
+
+
+class TransformCache:
+    """
+    Class which stores the result of aligning a scene as a json file: the affine matrix, or None if the alignment
+    failed, with the alignment tier and the size of the reference. The entry is keyed on the identity of the band files
+    of the scene and of the reference and on the alignment parameters, so that a rerun does not align the scene again.
+    """
+
+    def __init__(self, output_dir, scene: sc.PathScene, reference_scene: sc.PathScene, parameters: dict):
+        """
+        Initializes the cache entry path.
+        :param output_dir: The path_row output directory.
+        :param scene: The PathScene which is aligned.
+        :param reference_scene: The PathScene of the reference.
+        :param parameters: The alignment parameters which influence the affine matrix.
+        """
+        self.key = make_key(file_identity(scene.green_path),
+                            file_identity(scene.swir1_path),
+                            file_identity(reference_scene.green_path),
+                            file_identity(reference_scene.swir1_path),
+                            parameters)
+
+        self.cache_dir = os.path.join(output_dir, definitions.CACHE_DIR)
+        self.cache_path = os.path.join(self.cache_dir,
+                                       TRANSFORM_PREFIX + scene.get_scene_name() + "_" + self.key + ".json")
+
+    def load(self):
+        """
+        Loads the alignment result from the cache file.
+        :return: The dictionary with the affine, tier, width and height, or None if the file does not exist or cannot
+        be read.
+        """
+        if not os.path.isfile(self.cache_path):
+            return None
+
+        try:
+            with open(self.cache_path) as cache_file:
+                entry = json.load(cache_file)
+
+            if entry['affine'] is not None:
+                entry['affine'] = np.array(entry['affine'], dtype=np.float64)
+            entry['width'], entry['height'] = int(entry['width']), int(entry['height'])
+        except (OSError, KeyError, TypeError, ValueError):
+            return None
+
+        return entry
+
+    def store(self, affine, tier, size) -> None:
+        """
+        Writes the alignment result to the cache file, under a temporary name which is then renamed.
+        :param affine: The 2x3 affine matrix, or None if the alignment failed.
+        :param tier: The alignment tier which found the affine.
+        :param size: The width and height of the reference.
+        :return: None
+        """
+        entry = {
+            'affine': None if affine is None else np.asarray(affine).tolist(),
+            'tier': tier,
+            'width': size[0],
+            'height': size[1]
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary_path = self.cache_path + ".tmp"
+        with open(temporary_path, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(temporary_path, self.cache_path)
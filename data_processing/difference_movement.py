@@ -7,6 +7,10 @@ import sys
 import cv2
 import numpy as np
 
+sys.path.append(sys.path[0] + '/..')
+import definitions
+from data_processing import scenes as sc, ndsi as nc, ndsi_encoding as ne
+
 
 class DifferenceMovement:
     """
@@ -23,8 +27,8 @@ class DifferenceMovement:
         """
         np.seterr(divide='ignore', invalid='ignore')
 
-        image1 = cv2.imread(image2_path, cv2.IMREAD_GRAYSCALE)
-        image2 = cv2.imread(image1_path, cv2.IMREAD_GRAYSCALE)
+        image1 = read_ndsi_image(image2_path)
+        image2 = read_ndsi_image(image1_path)
 
         mask1, mask2 = self.create_mask(image1=image1,
                                         image2=image2)
@@ -145,6 +149,25 @@ class DifferenceMovement:
         cv2.imwrite(image2_path, self.image_move)
 
 
+def read_ndsi_image(path) -> np.ndarray:
+    """
+    Reads the NDSI image of an aligned scene, normalized to 8 bit. In the transform output mode there is no NDSI image
+    on disk, so the NDSI is computed from the source bands and warped with the transform of the scene.
+    :param path: Path to the NDSI image, or to the transform file of the scene.
+    :return: np.ndarray. Exits with code 6 if the NDSI image cannot be read.
+    """
+    if not path.endswith(definitions.TRANSFORM_END):
+        ndsi = ne.read_geotiff(path)
+        if ndsi is None:
+            sys.exit(6)
+    else:
+        transform = sc.TransformScene.read(path)
+        source = sc.NumpyScene.read(transform.source_scene, window=transform.window)
+        ndsi = transform.warp_ndsi(nc.NDSI.calculate_NDSI(source))
+
+    return cv2.normalize(ndsi, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8UC1)
+
+
 def image(window_name, image) -> None:
     """
     Display a numpy image.
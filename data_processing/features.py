@@ -0,0 +1,114 @@
+"""
+Module which holds the numpy array representation of the feature points of an image.
+"""
+import cv2
+import numpy as np
+
+DESCRIPTOR_SIZE = 32  # the number of bytes of an ORB descriptor
+
+
+class Features:
+    """
+    Class which holds the feature points of an image as numpy arrays: the coordinates, the detector responses, the box
+    of the grid each point was found in and the descriptors. Row i of each array describes the same point.
+    """
+
+    def __init__(self, points, responses, cells, descriptors):
+        """
+        Initializes the feature arrays.
+        :param points: Array of shape (N, 2) with the x and y coordinates, float32.
+        :param responses: Array of shape (N,) with the detector responses, float32.
+        :param cells: Array of shape (N,) with the grid box index, as row * columns + column, int32.
+        :param descriptors: Array of shape (N, 32) with the ORB descriptors, uint8.
+        """
+        self.points = points
+        self.responses = responses
+        self.cells = cells
+        self.descriptors = descriptors
+
+    def __len__(self) -> int:
+        """
+        Returns the number of feature points.
+        :return: int
+        """
+        return len(self.points)
+
+    @staticmethod
+    def empty():
+        """
+        Creates the features of an image without feature points.
+        :return: Features
+        """
+        return Features(np.empty((0, 2), dtype=np.float32),
+                        np.empty(0, dtype=np.float32),
+                        np.empty(0, dtype=np.int32),
+                        np.empty((0, DESCRIPTOR_SIZE), dtype=np.uint8))
+
+    @staticmethod
+    def from_keypoints(keypoints, descriptors, offset=(0, 0), cell=0):
+        """
+        Converts the keypoints and descriptors returned by cv2 for one box to arrays, moving the points by the offset
+        of the box in the whole image.
+        :param keypoints: The cv2 keypoints.
+        :param descriptors: The cv2 descriptors, None if there are no keypoints.
+        :param offset: The x and y coordinates of the box in the whole image.
+        :param cell: The index of the box in the grid.
+        :return: Features
+        """
+        if len(keypoints) == 0 or descriptors is None:
+            return Features.empty()
+
+        points = cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+        points += np.array(offset, dtype=np.float32)
+        responses = np.fromiter((keypoint.response for keypoint in keypoints), dtype=np.float32,
+                                count=len(keypoints))
+        cells = np.full(len(keypoints), cell, dtype=np.int32)
+
+        return Features(points, responses, cells, descriptors)
+
+    @staticmethod
+    def concatenate(features_list):
+        """
+        Concatenates the features of several boxes or bands, keeping their order.
+        :param features_list: List of Features.
+        :return: Features
+        """
+        if len(features_list) == 0:
+            return Features.empty()
+
+        return Features(np.concatenate([features.points for features in features_list]),
+                        np.concatenate([features.responses for features in features_list]),
+                        np.concatenate([features.cells for features in features_list]),
+                        np.concatenate([features.descriptors for features in features_list]))
+
+    def select(self, indices):
+        """
+        Returns the features at the given indices.
+        :param indices: Integer index array or boolean mask.
+        :return: Features
+        """
+        return Features(self.points[indices], self.responses[indices], self.cells[indices], self.descriptors[indices])
+
+    def select_best_per_cell(self, budget):
+        """
+        Keeps the budget feature points with the strongest response of each box, without looping over the points: the
+        points are sorted by box and then by response, and the rank of each point inside its box is its position minus
+        the position of the first point of the box. The kept points stay in their original order.
+        :param budget: The maximum number of points of a box.
+        :return: Features
+        """
+        order = np.lexsort((-self.responses, self.cells))
+        sorted_cells = self.cells[order]
+        rank = np.arange(len(order)) - np.searchsorted(sorted_cells, sorted_cells, side='left')
+
+        return self.select(np.sort(order[rank < budget]))
+
+    def to_keypoints(self, size=31) -> list:
+        """
+        Converts the points back to cv2 keypoints, for drawing them.
+        :param size: The diameter of the drawn keypoints.
+        :return: list
+        """
+        if len(self) == 0:
+            return []
+        return list(cv2.KeyPoint_convert(self.points, size=size))
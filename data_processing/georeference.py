@@ -0,0 +1,183 @@
+"""
+Module which converts the glacier coordinates to the pixel coordinates of a scene, so that only the window of the scene
+around the glacier is read and aligned.
+"""
+import os
+
+import numpy as np
+from osgeo import gdal, osr
+
+import definitions
+from data_gathering import scene_metadata as sm
+from util import strings
+
+GLACIER_DIR_SEPARATOR = '_'  # the glacier directories are named <wgi_glacier_id>_<lon>_<lat>
+WGS84_EPSG = 4326  # the coordinate system of the glacier dataset
+
+# the pixel position of the MTL corners, as fractions of the width and height
+MTL_CORNERS = {
+    'UL': (0, 0),
+    'UR': (1, 0),
+    'LL': (0, 1),
+    'LR': (1, 1)
+}
+
+
+def glacier_coordinates(glacier_dir):
+    """
+    Parses the longitude and latitude of the glacier from the name of its directory.
+    :param glacier_dir: The glacier directory, or its name.
+    :return: The (lon, lat) tuple, or None if the name does not end with the coordinates.
+    """
+    name = os.path.basename(os.path.normpath(glacier_dir))
+    parts = name.split(GLACIER_DIR_SEPARATOR)
+    if len(parts) < 3:
+        return None
+
+    try:
+        return float(parts[-2]), float(parts[-1])
+    except ValueError:
+        return None
+
+
+def raster_size(band_path):
+    """
+    Returns the size of a band, read from its header.
+    :param band_path: Path to the band.
+    :return: The (width, height) tuple, or None if the band cannot be opened.
+    """
+    dataset = gdal.Open(band_path)
+    if dataset is None:
+        return None
+
+    return dataset.RasterXSize, dataset.RasterYSize
+
+
+def geotiff_lonlat_to_pixels(band_path, lonlats):
+    """
+    Converts longitudes and latitudes to the pixel coordinates of a band, using the projection and the geotransform of
+    the GeoTIFF.
+    :param band_path: Path to the band.
+    :param lonlats: List of (lon, lat) tuples, in degrees.
+    :return: The list of (x, y) tuples, or None if the band has no georeferencing.
+    """
+    dataset = gdal.Open(band_path)
+    if dataset is None or not dataset.GetProjection():
+        return None
+
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(WGS84_EPSG)
+    # GDAL 3 takes the EPSG:4326 axes as lat, lon unless asked otherwise
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    projection = osr.SpatialReference(wkt=dataset.GetProjection())
+
+    inverse_geotransform = gdal.InvGeoTransform(dataset.GetGeoTransform())
+    if inverse_geotransform is None:
+        return None
+
+    try:
+        transform = osr.CoordinateTransformation(wgs84, projection)
+        projected = [transform.TransformPoint(lon, lat)[0:2] for lon, lat in lonlats]
+    except RuntimeError:
+        return None
+
+    return [tuple(gdal.ApplyGeoTransform(inverse_geotransform, easting, northing)) for easting, northing in projected]
+
+
+def mtl_lonlat_to_pixels(band_path, lonlats, size):
+    """
+    Converts longitudes and latitudes to the pixel coordinates of a band, using the corner coordinates of the MTL file
+    of the scene. The affine which maps the corners best is used; over a scene it is close to the projection.
+    :param band_path: Path to the band.
+    :param lonlats: List of (lon, lat) tuples, in degrees.
+    :param size: The (width, height) of the band.
+    :return: The list of (x, y) tuples, or None if the MTL file is missing or incomplete.
+    """
+    input_dir = os.path.split(band_path)[0]
+    metadata_path = os.path.join(input_dir, strings.get_scene_name(band_path) + definitions.METADATA_END)
+    if not os.path.isfile(metadata_path):
+        return None
+
+    coordinates = sm.SceneMetadata(metadata_path).get_scene_set_coordinates()
+    width, height = size
+
+    corners_lonlat = []
+    corners_pixel = []
+    try:
+        for corner, (x, y) in MTL_CORNERS.items():
+            corner_lon = float(coordinates['CORNER_' + corner + '_LON_PRODUCT'])
+            corner_lat = float(coordinates['CORNER_' + corner + '_LAT_PRODUCT'])
+            corners_lonlat.append([corner_lon, corner_lat, 1])
+            corners_pixel.append([x * (width - 1), y * (height - 1)])
+    except ValueError:
+        return None
+
+    lonlat_to_pixel, residuals, rank, singular = np.linalg.lstsq(np.array(corners_lonlat), np.array(corners_pixel),
+                                                                 rcond=None)
+    points = np.column_stack((np.array(lonlats, dtype=np.float64).reshape(-1, 2), np.ones(len(lonlats))))
+
+    return [(float(x), float(y)) for x, y in points.dot(lonlat_to_pixel)]
+
+
+def lonlat_to_pixels(band_path, lonlats):
+    """
+    Converts longitudes and latitudes to the pixel coordinates of a band, from the GeoTIFF georeferencing, or from the
+    MTL corners when the band has none. The band header is read once for all the coordinates.
+    :param band_path: Path to the band.
+    :param lonlats: List of (lon, lat) tuples, in degrees.
+    :return: The list of (x, y) tuples, or None if the band cannot be georeferenced.
+    """
+    pixels = geotiff_lonlat_to_pixels(band_path, lonlats)
+    if pixels is not None:
+        return pixels
+
+    size = raster_size(band_path)
+    if size is None:
+        return None
+
+    return mtl_lonlat_to_pixels(band_path, lonlats, size)
+
+
+def lonlat_to_pixel(band_path, lon, lat):
+    """
+    Converts a longitude and latitude to the pixel coordinates of a band, from the GeoTIFF georeferencing, or from the
+    MTL corners when the band has none.
+    :param band_path: Path to the band.
+    :param lon: The longitude, in degrees.
+    :param lat: The latitude, in degrees.
+    :return: The (x, y) tuple, or None if the band cannot be georeferenced.
+    """
+    pixels = lonlat_to_pixels(band_path, [(lon, lat)])
+    return None if pixels is None else pixels[0]
+
+
+def glacier_window(band_path, lon, lat, window_size):
+    """
+    Returns the window of the band centered on the glacier. The window is moved inside the band instead of being cut
+    at its border, so that the windows of the scenes and of the reference have the same size.
+    :param band_path: Path to the band.
+    :param lon: The longitude of the glacier, in degrees.
+    :param lat: The latitude of the glacier, in degrees.
+    :param window_size: The side of the window, in pixels.
+    :return: The (x offset, y offset, width, height) tuple, or None if the glacier is not inside the band.
+    """
+    size = raster_size(band_path)
+    if size is None:
+        return None
+
+    pixel = lonlat_to_pixel(band_path, lon, lat)
+    if pixel is None:
+        return None
+
+    x, y = pixel
+    width, height = size
+    if not (0 <= x < width and 0 <= y < height):
+        return None
+
+    window_width = min(window_size, width)
+    window_height = min(window_size, height)
+    x_offset = int(np.clip(round(x - window_width / 2), 0, width - window_width))
+    y_offset = int(np.clip(round(y - window_height / 2), 0, height - window_height))
+
+    return x_offset, y_offset, window_width, window_height
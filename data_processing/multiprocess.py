@@ -1,6 +1,7 @@
 """
 Class which holds multiprocessing handling.
 """
+import multiprocessing
 import signal
 import subprocess
 
@@ -93,3 +94,117 @@ class Multiprocess:
         """
         for task_name, sp in self.process_queue:
             sp.send_signal(signal)
+
+    def close(self) -> None:
+        """
+        Waits for the remaining processes; there are no long lived resources to release.
+        :return: None
+        """
+        self.wait_all_process_done()
+
+
+def ignore_interrupt() -> None:
+    """
+    Initializer of the pool workers, which leaves the interrupt handling to the parent process.
+    :return: None
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class WorkerPool:
+    """
+    Class which handles a pool of long lived worker processes. The workers import the processing modules once and take
+    the tasks as function calls, instead of starting a new interpreter for each task. It has the same interface as
+    Multiprocess, and the handler receives the value returned by the task function as return code.
+    """
+
+    POLL_TIMEOUT = 0.05  # seconds to wait for the oldest task before checking the others
+
+    def __init__(self, max_processes=definitions.MAX_PROCESSES, handler=None):
+        """
+        Starts the worker processes.
+        :param max_processes: Number of worker processes.
+        :param handler: The method which runs each time a task has finished.
+        """
+        self.max_processes = max_processes
+        self.process_queue = []
+        self.handler = handler
+
+        # spawn instead of fork, since forking a process which already runs OpenCV threads can deadlock
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(processes=max_processes, initializer=ignore_interrupt)
+
+    def start_processing(self, task, task_name, args=()) -> None:
+        """
+        Waits for a spot to free in the queue of tasks, then sends the task to the pool. The queue holds two tasks per
+        worker, so that a worker never waits for the parent to send the next task.
+        :param task: Function to call in a worker. It must be importable, since it is sent to the workers by name.
+        :param task_name: Name of the task to process, for visual debugging and interpretation.
+        :param args: Arguments of the task function.
+        :return: None
+        """
+        self.poll_process_done()
+        print(definitions.PRINT_CODES[0] + blue("Tasks in queue before add: "), blue(len(self.process_queue)))
+
+        result = self.pool.apply_async(task, args)
+        self.process_queue.append((task_name, result))
+
+        print(definitions.PRINT_CODES[0] + blue("Tasks in queue after add: "), blue(len(self.process_queue)))
+
+    def check_process_done(self) -> None:
+        """
+        Checks the queue for finished tasks; if found, it removes them and calls the handler function with their return
+        code. A task which raised an exception is reported with the return code 4.
+        :return: None
+        """
+        if len(self.process_queue) > 0:
+            task_name, result = self.process_queue[0]
+            result.wait(self.POLL_TIMEOUT)
+
+        for task_name, result in list(self.process_queue):
+            if not result.ready():
+                continue
+
+            self.process_queue.remove((task_name, result))
+            try:
+                return_code = result.get()
+            except Exception as e:
+                print(definitions.PRINT_CODES[1] + red("Task failed: "), task_name, e)
+                return_code = 4
+
+            print(definitions.PRINT_CODES[0] + blue("Query done: "), blue(task_name))
+            if self.handler is not None:
+                self.handler(task_name, return_code)
+
+    def poll_process_done(self) -> None:
+        """
+        Waits until there is a free spot in the queue of tasks.
+        :return: None
+        """
+        while len(self.process_queue) >= 2 * self.max_processes:
+            self.check_process_done()
+
+    def wait_all_process_done(self) -> None:
+        """
+        Waits till all the tasks from the queue are done.
+        :return: None
+        """
+        while len(self.process_queue) > 0:
+            self.check_process_done()
+
+    def kill_all_processes(self, signal=signal.SIGINT) -> None:
+        """
+        Terminates the workers, dropping the queued tasks.
+        :return: None
+        """
+        self.pool.terminate()
+        self.process_queue = []
+
+    def close(self) -> None:
+        """
+        Waits for the remaining tasks and stops the workers.
+        :return: None
+        """
+        self.wait_all_process_done()
+        self.pool.close()
+        self.pool.join()
@@ -1,9 +1,258 @@
 """Module which contains the class which creates the Normalised Difference Snow Index (NDSI) file."""
+import csv
+import sys
+from fractions import Fraction
+from statistics import NormalDist
+
 import numpy as np
+from osgeo import gdal
 
-from data_processing import scenes as sc
+sys.path.append(sys.path[0] + '/..')
+import definitions
+from data_processing import scenes as sc, ndsi_encoding as ne
 import cv2
 
+NDSI_STRIP_ROWS = 64  # the number of rows computed at once, so that the temporary buffers stay in the cache
+BAND_MAX_VALUE = np.iinfo(np.uint16).max  # the largest value of the bands, which bounds the denominators of the NDSI
+
+# the classes of the pixels of the snow class image
+NO_DATA_CLASS = 0
+GROUND_CLASS = 1
+SNOW_CLASS = 2
+
+# sampled snow ratio
+SAMPLE_ERROR_TARGET = 0.01  # the sampling stops when the half width of the confidence interval is below this
+SAMPLE_CONFIDENCE = 0.95  # the confidence level of the interval
+SAMPLE_STRATA = 8  # the scene is split into SAMPLE_STRATA x SAMPLE_STRATA strata of blocks
+SAMPLE_ROUND_BLOCKS = 2  # the number of blocks sampled from each stratum in a round, at least 2 for the variance
+SAMPLE_ARGUMENT = '--sample'  # the command line argument which estimates the ratio instead of computing it
+
+
+class NDSIStrip:
+    """
+    Class which holds the buffers of a strip of rows, allocated once and reused for computing the NDSI of each strip of
+    a scene, so that the temporary images stay in the cache.
+    """
+
+    def __init__(self, strip_rows, width, threshold=0.5, float_dtype=np.float32):
+        """
+        Allocates the buffers of the strip.
+        :param strip_rows: The maximal number of rows of a strip.
+        :param width: The width of the bands.
+        :param threshold: The threshold above which a pixel is snow, None for computing only the NDSI.
+        :param float_dtype: The floating point type the NDSI is computed in.
+        """
+        self.threshold = threshold
+        self.float_dtype = float_dtype
+
+        self.numerator = np.empty((strip_rows, width), dtype=float_dtype)
+        self.denominator = np.empty((strip_rows, width), dtype=float_dtype)
+        self.mask = np.empty((strip_rows, width), dtype=bool)
+        self.snow = np.empty((strip_rows, width), dtype=bool)
+
+    def compute(self, green, swir) -> tuple:
+        """
+        Computes the NDSI of a strip and counts its snow pixels. The pixels where a band is 0 valued, the borders after
+        the alignment, are excluded from the division instead of going through NaN values, and are -1.
+        :param green: The green band of the strip.
+        :param swir: The swir1 band of the strip.
+        :return: The NDSI of the strip, a view of the strip buffer which the next strip overwrites, and the number of
+        snow pixels, None without a threshold.
+        """
+        rows = green.shape[0]
+        numerator, denominator = self.numerator[:rows], self.denominator[:rows]
+        mask, snow = self.mask[:rows], self.snow[:rows]
+
+        np.subtract(green, swir, out=numerator, dtype=self.float_dtype)
+        np.add(green, swir, out=denominator, dtype=self.float_dtype)
+
+        # the mask holds the valid pixels for the division, then the border pixels
+        np.logical_and(green, swir, out=mask)
+        np.divide(numerator, denominator, out=numerator, where=mask)
+        np.logical_not(mask, out=mask)
+        np.copyto(numerator, -1, where=mask)
+
+        if self.threshold is None:
+            return numerator, None
+
+        np.greater(numerator, self.threshold, out=snow)
+
+        return numerator, np.count_nonzero(snow)
+
+
+class SnowMaskStrip:
+    """
+    Class which classifies the snow pixels of a strip of rows on the integer bands. For a valid pixel, where no band is
+    0 valued, NDSI > p / q is (green - swir) / (green + swir) > p / q, so it is (q - p) * green > (q + p) * swir, which is
+    evaluated exactly on integers, without the float NDSI and the division. The buffers are allocated once and reused for
+    each strip of a scene.
+
+    The threshold is taken exactly, as Fraction(threshold). The NDSI of a valid pixel is a fraction whose denominator
+    green + swir is at most 2 * max_value, so it is compared with the closest fraction p / q to the threshold of such a
+    denominator instead: no NDSI value lies between the two, so the test gives the same pixels for any threshold, with
+    factors small enough for integer buffers. The buffers are int32 when the products fit, int64 otherwise. When the
+    float threshold is the rounding of p / q, e.g. 0.3 of 3 / 10, the NDSI p / q is not above it, as in the comparison of
+    the float NDSI, which rounds that value to the threshold.
+    """
+
+    def __init__(self, strip_rows, width, threshold=0.5, max_value=BAND_MAX_VALUE):
+        """
+        Allocates the buffers of the strip and converts the threshold to a fraction.
+        :param strip_rows: The maximal number of rows of a strip.
+        :param width: The width of the bands.
+        :param threshold: The threshold above which a pixel is snow.
+        :param max_value: The largest value of the bands.
+        """
+        exact = Fraction(threshold)
+        fraction = exact.limit_denominator(2 * max_value)
+        self.green_factor = fraction.denominator - fraction.numerator
+        self.swir_factor = fraction.denominator + fraction.numerator
+        # the closest fraction is above the threshold only if no NDSI value lies in [threshold, fraction), so the NDSI
+        # values equal to the fraction are then above the threshold too, unless the threshold is their float rounding
+        self.inclusive = fraction > exact and float(fraction) != float(threshold)
+        # the border pixels have the NDSI -1
+        self.border_is_snow = -1 > exact
+
+        products = max(abs(self.green_factor), abs(self.swir_factor)) * max_value
+        dtype = np.int32 if products <= np.iinfo(np.int32).max else np.int64
+        self.green = np.empty((strip_rows, width), dtype=dtype)
+        self.swir = np.empty((strip_rows, width), dtype=dtype)
+        self.snow = np.empty((strip_rows, width), dtype=bool)
+        self.border = np.empty((strip_rows, width), dtype=bool)
+
+    def compute(self, green, swir) -> tuple:
+        """
+        Computes the snow mask of a strip.
+        :param green: The green band of the strip.
+        :param swir: The swir1 band of the strip.
+        :return: The snow mask of the strip, a view of the strip buffer which the next strip overwrites, and the number
+        of snow pixels.
+        """
+        rows = green.shape[0]
+        green_term, swir_term = self.green[:rows], self.swir[:rows]
+        snow, border = self.snow[:rows], self.border[:rows]
+
+        np.multiply(green, self.green_factor, out=green_term, dtype=green_term.dtype)
+        np.multiply(swir, self.swir_factor, out=swir_term, dtype=swir_term.dtype)
+        if self.inclusive:
+            np.greater_equal(green_term, swir_term, out=snow)
+        else:
+            np.greater(green_term, swir_term, out=snow)
+
+        np.logical_and(green, swir, out=border)
+        np.logical_not(border, out=border)
+        np.copyto(snow, self.border_is_snow, where=border)
+
+        return snow, np.count_nonzero(snow)
+
+
+class HistogramStrip:
+    """
+    Class which counts the NDSI values of the valid pixels of a strip of rows in fixed bins, on the integer bands. Bin k
+    holds the NDSI values in (-1 + 2k / bins, -1 + 2(k + 1) / bins]; since NDSI + 1 = 2 * green / (green + swir), the bin
+    of a valid pixel is k = (bins * green - 1) // (green + swir), which is exact. The border pixels, where a band is 0
+    valued, are counted in the extra last bin. The buffers are allocated once and reused for each strip of a scene.
+    """
+
+    def __init__(self, strip_rows, width, bins=definitions.NDSI_HISTOGRAM_BINS):
+        """
+        Allocates the buffers of the strip.
+        :param strip_rows: The maximal number of rows of a strip.
+        :param width: The width of the bands.
+        :param bins: The number of bins over [-1, 1].
+        """
+        self.bins = bins
+
+        self.numerator = np.empty((strip_rows, width), dtype=np.int32)
+        self.denominator = np.empty((strip_rows, width), dtype=np.int32)
+        self.mask = np.empty((strip_rows, width), dtype=bool)
+
+    def compute(self, green, swir) -> np.ndarray:
+        """
+        Counts the NDSI values of a strip.
+        :param green: The green band of the strip.
+        :param swir: The swir1 band of the strip.
+        :return: The counts of the bins, followed by the number of border pixels.
+        """
+        rows = green.shape[0]
+        numerator, denominator, mask = self.numerator[:rows], self.denominator[:rows], self.mask[:rows]
+
+        np.multiply(green, self.bins, out=numerator, dtype=np.int32)
+        np.subtract(numerator, 1, out=numerator)
+        np.add(green, swir, out=denominator, dtype=np.int32)
+
+        # the mask holds the valid pixels for the division, then the border pixels
+        np.logical_and(green, swir, out=mask)
+        np.floor_divide(numerator, denominator, out=numerator, where=mask)
+        np.logical_not(mask, out=mask)
+        np.copyto(numerator, self.bins, where=mask)
+
+        return np.bincount(numerator.ravel(), minlength=self.bins + 1)
+
+
+class SampleStratum:
+    """
+    Class which holds the blocks of a stratum of a scene, in the random order they are sampled in, and the snow and
+    pixel counts of the sampled ones. The snow ratio of the stratum is estimated with the ratio estimator of cluster
+    sampling, the blocks being the clusters.
+    """
+
+    def __init__(self, blocks, block_sizes, rng):
+        """
+        Initializes the stratum and shuffles its blocks.
+        :param blocks: List of (x, y, width, height) of the blocks of the stratum, relative to the window.
+        :param block_sizes: The number of pixels of each block.
+        :param rng: The np.random.Generator which orders the blocks.
+        """
+        order = rng.permutation(len(blocks))
+        self.blocks = [blocks[i] for i in order]
+        self.pixels = int(sum(block_sizes))
+
+        self.snow_counts = []
+        self.pixel_counts = []
+
+    def next_blocks(self, count) -> list:
+        """
+        Returns the next blocks to sample.
+        :param count: The maximal number of blocks.
+        :return: list
+        """
+        sampled = len(self.snow_counts)
+        return self.blocks[sampled:sampled + count]
+
+    def add(self, snow_pixels, pixels) -> None:
+        """
+        Records the counts of a sampled block.
+        :param snow_pixels: The number of snow pixels of the block.
+        :param pixels: The number of pixels of the block.
+        :return: None
+        """
+        self.snow_counts.append(snow_pixels)
+        self.pixel_counts.append(pixels)
+
+    def estimate(self) -> tuple:
+        """
+        Estimates the snow ratio of the stratum and its variance, with the finite population correction, so that a
+        stratum whose blocks are all sampled has no variance.
+        :return: The estimated ratio and its variance, infinite if fewer than 2 blocks of a partly sampled stratum are.
+        """
+        sampled = len(self.snow_counts)
+        snow = np.array(self.snow_counts, dtype=np.float64)
+        pixels = np.array(self.pixel_counts, dtype=np.float64)
+        ratio = snow.sum() / pixels.sum()
+
+        if sampled == len(self.blocks):
+            return ratio, 0.0
+        if sampled < 2:
+            return ratio, float('inf')
+
+        residuals = snow - ratio * pixels
+        variance = (1 - sampled / len(self.blocks)) * residuals.dot(residuals) / (sampled - 1) / \
+            (sampled * pixels.mean() ** 2)
+
+        return ratio, variance
+
+
 class NDSI:
     """Class which handles the creation of the Normalised Difference Snow Index (NDSI) file."""
 
@@ -16,39 +265,335 @@ class NDSI:
     @staticmethod
     def calculate_NDSI(numpy_scene, math_dtype=np.float32) -> np.ndarray:
         """
-        Calculates the NDSI image as a np array, by converting to float32 for easy computation, treating the borders
-        as NaN in order to ignore those values, since after the alignment, the borders are 0 valued. The interval of
-        calculation is normalized in order to make 16bit fit float32.
+        Calculates the NDSI image as a np array. The borders, where a band is 0 valued after the alignment, are -1.
         :param numpy_scene: Satellite image containing green and swir1 np images.
         :param math_dtype: Data type for mathematical calculations.
         :return: Returns the np array containing the result of the division.
         """
+        ndsi, snow_pixels_ratio = NDSI.calculate_NDSI_and_snow_ratio(numpy_scene, threshold=None, math_dtype=math_dtype)
+        return ndsi
 
-        green_nan = numpy_scene.green_numpy.astype(math_dtype)
-        swir_nan = numpy_scene.swir1_numpy.astype(math_dtype)
+    @staticmethod
+    def calculate_NDSI_and_snow_ratio(numpy_scene, threshold=0.5, math_dtype=np.float32, keep_ndsi=True) -> tuple:
+        """
+        Calculates the NDSI image and its snow pixel ratio in a single pass over the bands. The pass goes strip of rows
+        by strip of rows through a NDSIStrip, so that only the result has the size of the scene. The snow pixels are
+        the ones above the threshold, counted over all the pixels, as get_snow_pixels_ratio counts them on the snow
+        image.
+        :param numpy_scene: Satellite image containing green and swir1 np images.
+        :param threshold: The threshold for calculating the number of snow pixels, None for computing only the NDSI.
+        :param math_dtype: Data type for mathematical calculations. For np.int32, the NDSI is scaled from [-1, 1] to
+        [0, 0xFFFE].
+        :param keep_ndsi: If set to False, only the snow pixel ratio is computed, without the NDSI image of the scene.
+        :return: The NDSI image, None if keep_ndsi is False, and the snow pixel ratio, None without a threshold.
+        """
+        green = numpy_scene.green_numpy
+        swir = numpy_scene.swir1_numpy
+        height, width = green.shape
+        strip_rows = min(NDSI_STRIP_ROWS, height)
 
-        green_nan[green_nan == 0] = np.nan
-        swir_nan[swir_nan == 0] = np.nan
+        # the division is done in floating point; the integer NDSI is scaled from it
+        float_dtype = math_dtype if np.issubdtype(math_dtype, np.floating) else np.float32
+        strip = NDSIStrip(strip_rows, width, threshold, float_dtype)
 
-        # change image bit depth to 32 bit to allow math without saturation
-        img = sc.NumpyScene(green_nan, swir_nan)
+        ndsi = np.empty((height, width), dtype=math_dtype) if keep_ndsi else None
+        snow_pixels = 0
 
-        # ignore division by zero because image has borders with 0 values
-        np.seterr(divide='ignore', invalid='ignore')
+        for start in range(0, height, strip_rows):
+            strip_ndsi, strip_snow_pixels = strip.compute(green[start:start + strip_rows],
+                                                          swir[start:start + strip_rows])
+            if threshold is not None:
+                snow_pixels += strip_snow_pixels
 
-        numerator = np.subtract(img.green_numpy, img.swir1_numpy)
-        if math_dtype == np.int32:
-            numerator = np.multiply(numerator, 0x7FFF)
-        denominator = np.add(img.green_numpy, img.swir1_numpy)
-        ndsi = np.divide(numerator, denominator)
+            if keep_ndsi:
+                rows = strip_ndsi.shape[0]
+                if float_dtype is math_dtype:
+                    ndsi[start:start + rows] = strip_ndsi
+                else:
+                    np.multiply(strip_ndsi, 0x7FFF, out=strip_ndsi)
+                    np.add(strip_ndsi, 0x7FFF, out=ndsi[start:start + rows], casting='unsafe')
 
-        # interpret each NaN value as 0
-        ndsi[ndsi != ndsi] = -1
+        return ndsi, None if threshold is None else snow_pixels / green.size
 
-        if math_dtype == np.int32:
-            ndsi = np.add(ndsi, 0x7FFF)
+    @staticmethod
+    def open_bands(path_scene) -> tuple:
+        """
+        Opens the band files of a scene with GDAL, without reading them.
+        :param path_scene: The PathScene of the bands.
+        :return: The GDAL datasets of the green and the swir1 band. Exits with code 6 if a band cannot be opened or the
+        bands have different sizes.
+        """
+        green_dataset = gdal.Open(path_scene.green_path)
+        swir_dataset = gdal.Open(path_scene.swir1_path)
+        if green_dataset is None or swir_dataset is None:
+            sys.exit(6)
+        if (green_dataset.RasterXSize, green_dataset.RasterYSize) != \
+                (swir_dataset.RasterXSize, swir_dataset.RasterYSize):
+            sys.exit(6)
 
-        return ndsi
+        return green_dataset, swir_dataset
+
+    @staticmethod
+    def stream_NDSI(path_scene, threshold=0.5, ndsi_path=None, window=None, reference_scene=None,
+                    reference_window=None) -> float:
+        """
+        Computes the snow pixel ratio of a scene straight from the band files, and writes its NDSI image if a path is
+        given. The bands are read with GDAL in strips of whole blocks, in the order they are stored, and each strip is
+        classified through a SnowMaskStrip, and its NDSI computed through a NDSIStrip and written, before the next one
+        is read, so the memory does not depend on the size of the scene.
+        :param path_scene: The PathScene of the bands.
+        :param threshold: The threshold for calculating the number of snow pixels, None for only writing the NDSI.
+        :param ndsi_path: Path to the NDSI GeoTIFF which is written in the definitions.NDSI_ENCODING encoding, None for
+        computing only the ratio.
+        :param window: The (x offset, y offset, width, height) of the part of the bands which is read, None for all.
+        :param reference_scene: The PathScene whose green band georeferences the NDSI, None for the green band of the
+        scene, e.g. for bands which are aligned onto the reference.
+        :param reference_window: The (x offset, y offset, width, height) of the part of the reference band the NDSI
+        covers, used with the reference_scene.
+        :return: The snow pixel ratio, None if the threshold is None. Exits with code 6 if the bands cannot be read or
+        the NDSI written.
+        """
+        green_dataset, swir_dataset = NDSI.open_bands(path_scene)
+        if window is None:
+            window = (0, 0, green_dataset.RasterXSize, green_dataset.RasterYSize)
+        x_offset, y_offset, width, height = window
+
+        green_band = green_dataset.GetRasterBand(1)
+        swir_band = swir_dataset.GetRasterBand(1)
+
+        # a strip is made of whole blocks, so that each block of the file is read once
+        block_rows = green_band.GetBlockSize()[1]
+        strip_rows = min(height, max(block_rows, NDSI_STRIP_ROWS // block_rows * block_rows))
+        snow_strip = None if threshold is None else SnowMaskStrip(strip_rows, width, threshold)
+
+        ndsi_strip = None
+        ndsi_dataset = None
+        if ndsi_path is not None:
+            source_dataset, source_window = green_dataset, window
+            if reference_scene is not None:
+                source_dataset, source_window = gdal.Open(reference_scene.green_path), reference_window
+                if source_dataset is None:
+                    sys.exit(6)
+            ndsi_strip = NDSIStrip(strip_rows, width, threshold=None)
+            ndsi_dataset = ne.create_geotiff(ndsi_path, width, height, source_dataset=source_dataset,
+                                             window=source_window)
+            if ndsi_dataset is None:
+                sys.exit(6)
+
+        snow_pixels = 0
+        for start in range(0, height, strip_rows):
+            rows = min(strip_rows, height - start)
+            strip_green = green_band.ReadAsArray(x_offset, y_offset + start, width, rows)
+            strip_swir = swir_band.ReadAsArray(x_offset, y_offset + start, width, rows)
+            if strip_green is None or strip_swir is None:
+                sys.exit(6)
+
+            if snow_strip is not None:
+                strip_snow, strip_snow_pixels = snow_strip.compute(strip_green, strip_swir)
+                snow_pixels += strip_snow_pixels
+
+            if ndsi_dataset is not None:
+                strip_ndsi, strip_ndsi_snow_pixels = ndsi_strip.compute(strip_green, strip_swir)
+                ndsi_dataset.GetRasterBand(1).WriteArray(ne.encode(strip_ndsi), 0, start)
+
+        if ndsi_dataset is not None:
+            ndsi_dataset.FlushCache()
+
+        if snow_strip is None:
+            return None
+
+        return snow_pixels / (width * height)
+
+    @staticmethod
+    def sample_snow_ratio(path_scene, threshold=0.5, error_target=None, confidence=None, window=None,
+                          seed=None) -> tuple:
+        """
+        Estimates the snow pixel ratio of a scene from a stratified random sample of the blocks of its band files. The
+        blocks are the ones the files are stored in, and only the sampled ones are read, with windowed reads. Each
+        round samples SAMPLE_ROUND_BLOCKS more blocks of every stratum, until the half width of the confidence interval
+        is below the error target, or the whole scene is read.
+        :param path_scene: The PathScene of the bands.
+        :param threshold: The threshold for calculating the number of snow pixels.
+        :param error_target: The largest half width of the confidence interval, None for SAMPLE_ERROR_TARGET.
+        :param confidence: The confidence level of the interval, None for SAMPLE_CONFIDENCE.
+        :param window: The (x offset, y offset, width, height) of the part of the bands which is sampled, None for all.
+        :param seed: The seed of the random sample, None for a different sample on each call.
+        :return: The estimated snow pixel ratio, the lower and upper bounds of its confidence interval, and the
+        fraction of the pixels which were read. Exits with code 6 if the bands cannot be read.
+        """
+        if error_target is None:
+            error_target = SAMPLE_ERROR_TARGET
+        if confidence is None:
+            confidence = SAMPLE_CONFIDENCE
+
+        green_dataset, swir_dataset = NDSI.open_bands(path_scene)
+        if window is None:
+            window = (0, 0, green_dataset.RasterXSize, green_dataset.RasterYSize)
+        x_offset, y_offset, width, height = window
+
+        green_band = green_dataset.GetRasterBand(1)
+        swir_band = swir_dataset.GetRasterBand(1)
+        block_width, block_height = (min(size, limit) for size, limit in zip(green_band.GetBlockSize(),
+                                                                              (width, height)))
+
+        rng = np.random.default_rng(seed)
+        column_starts = np.arange(0, width, block_width)
+        row_starts = np.arange(0, height, block_height)
+        strata = []
+        for stratum_rows in np.array_split(row_starts, min(SAMPLE_STRATA, len(row_starts))):
+            for stratum_columns in np.array_split(column_starts, min(SAMPLE_STRATA, len(column_starts))):
+                blocks = [(int(x), int(y), int(min(block_width, width - x)), int(min(block_height, height - y)))
+                          for y in stratum_rows for x in stratum_columns]
+                strata.append(SampleStratum(blocks, [w * h for x, y, w, h in blocks], rng))
+
+        # the blocks on the right and bottom edges are smaller, so there is a strip for each block shape
+        strips = {}
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        while True:
+            for stratum in strata:
+                for x, y, w, h in stratum.next_blocks(SAMPLE_ROUND_BLOCKS):
+                    block_green = green_band.ReadAsArray(x_offset + x, y_offset + y, w, h)
+                    block_swir = swir_band.ReadAsArray(x_offset + x, y_offset + y, w, h)
+                    if block_green is None or block_swir is None:
+                        sys.exit(6)
+
+                    if (h, w) not in strips:
+                        strips[(h, w)] = SnowMaskStrip(h, w, threshold)
+                    block_snow, block_snow_pixels = strips[(h, w)].compute(block_green, block_swir)
+                    stratum.add(block_snow_pixels, w * h)
+
+            # the strata are weighted with their number of pixels
+            estimates = [stratum.estimate() for stratum in strata]
+            ratio = sum(stratum.pixels * stratum_ratio for stratum, (stratum_ratio, variance) in zip(strata, estimates))
+            ratio /= width * height
+            variance = sum((stratum.pixels / (width * height)) ** 2 * stratum_variance
+                           for stratum, (stratum_ratio, stratum_variance) in zip(strata, estimates))
+            half_width = z * np.sqrt(variance)
+
+            sampled_pixels = sum(sum(stratum.pixel_counts) for stratum in strata)
+            if half_width <= error_target or sampled_pixels == width * height:
+                break
+
+        return ratio, max(0.0, ratio - half_width), min(1.0, ratio + half_width), sampled_pixels / (width * height)
+
+    @staticmethod
+    def get_snow_statistics(numpy_scene, threshold=0.5, bins=definitions.NDSI_HISTOGRAM_BINS, block=None,
+                            classes=False, ndsi=False) -> dict:
+        """
+        Computes the snow statistics of a scene in a single pass over its strips of rows, so that each strip is read
+        once: the NDSI histogram through a HistogramStrip and, if asked, through a SnowMaskStrip, the snow and valid
+        pixel counts of the blocks and the snow class image, and through a NDSIStrip, the NDSI image. The valid pixels
+        are the ones where no band is 0 valued.
+        :param numpy_scene: Satellite image containing green and swir1 np images.
+        :param threshold: The threshold for the snow pixels of the block counts and of the class image.
+        :param bins: The number of histogram bins over [-1, 1].
+        :param block: The side of the counted blocks, in pixels, None for no block counts. The blocks on the right and
+        bottom edges are cut by the scene.
+        :param classes: If set to True, the uint8 image of the classes is computed: NO_DATA_CLASS where a band is 0
+        valued, SNOW_CLASS or GROUND_CLASS.
+        :param ndsi: If set to True, the float32 NDSI image is computed, as calculate_NDSI computes it.
+        :return: Dictionary with the 'histogram', the counts of the bins followed by the number of border pixels, the
+        int32 'snow_counts' and 'valid_counts' of the blocks, the 'classes' image and the 'ndsi' image, None when they
+        are not asked.
+        """
+        green = numpy_scene.green_numpy
+        swir = numpy_scene.swir1_numpy
+        height, width = green.shape
+        # a strip is made of whole blocks
+        strip_rows = NDSI_STRIP_ROWS if block is None else max(1, NDSI_STRIP_ROWS // block) * block
+        strip_rows = min(height, strip_rows)
+
+        histogram_strip = HistogramStrip(strip_rows, width, bins)
+        snow_strip = None
+        if block is not None or classes:
+            snow_strip = SnowMaskStrip(strip_rows, width, threshold)
+        ndsi_strip = NDSIStrip(strip_rows, width, threshold=None) if ndsi else None
+
+        statistics = {
+            'histogram': np.zeros(bins + 1, dtype=np.int64),
+            'snow_counts': None,
+            'valid_counts': None,
+            'classes': None,
+            'ndsi': np.empty((height, width), dtype=np.float32) if ndsi else None
+        }
+        if block is not None:
+            valid = np.empty((strip_rows, width), dtype=bool)
+            column_starts = np.arange(0, width, block)
+            statistics['snow_counts'] = np.empty((-(-height // block), len(column_starts)), dtype=np.int32)
+            statistics['valid_counts'] = np.empty_like(statistics['snow_counts'])
+        if classes:
+            statistics['classes'] = np.empty((height, width), dtype=np.uint8)
+
+        for start in range(0, height, strip_rows):
+            strip_green = green[start:start + strip_rows]
+            strip_swir = swir[start:start + strip_rows]
+            rows = strip_green.shape[0]
+
+            statistics['histogram'] += histogram_strip.compute(strip_green, strip_swir)
+            if ndsi_strip is not None:
+                strip_ndsi, strip_ndsi_snow_pixels = ndsi_strip.compute(strip_green, strip_swir)
+                statistics['ndsi'][start:start + rows] = strip_ndsi
+            if snow_strip is None:
+                continue
+
+            strip_snow, strip_snow_pixels = snow_strip.compute(strip_green, strip_swir)
+            strip_border = snow_strip.border[:rows]
+            # the snow pixels of the statistics are valid, whatever the threshold
+            np.copyto(strip_snow, False, where=strip_border)
+
+            if classes:
+                strip_classes = statistics['classes'][start:start + rows]
+                np.add(strip_snow, GROUND_CLASS, out=strip_classes, dtype=np.uint8)
+                np.copyto(strip_classes, NO_DATA_CLASS, where=strip_border)
+
+            if block is not None:
+                strip_valid = valid[:rows]
+                np.logical_not(strip_border, out=strip_valid)
+
+                row_starts = np.arange(0, rows, block)
+                block_rows = slice(start // block, start // block + len(row_starts))
+                for counts, mask in ((statistics['snow_counts'], strip_snow), (statistics['valid_counts'], strip_valid)):
+                    counts[block_rows] = np.add.reduceat(np.add.reduceat(mask, row_starts, axis=0, dtype=np.int32),
+                                                         column_starts, axis=1)
+
+        return statistics
+
+    @staticmethod
+    def get_snow_pixels_ratio_from_histogram(histogram, threshold=0.5) -> float:
+        """
+        Returns the snow pixel ratio of a scene from its NDSI histogram. The ratio is exact for the thresholds on the
+        bin edges, the multiples of 2 / bins - 1; the other thresholds are rounded to the nearest edge.
+        :param histogram: The counts of the bins, followed by the number of border pixels, as get_snow_statistics
+        returns it.
+        :param threshold: The threshold for calculating the number of snow pixels.
+        :return: float
+        """
+        histogram = np.asarray(histogram)
+        bins = len(histogram) - 1
+
+        edge = int(np.clip(round((threshold + 1) * bins / 2), 0, bins))
+        snow_pixels = histogram[edge:bins].sum()
+        # the border pixels have the NDSI -1
+        if -1 > threshold:
+            snow_pixels += histogram[bins]
+
+        return float(snow_pixels / histogram.sum())
+
+    @staticmethod
+    def read_histogram_csv(csv_path) -> dict:
+        """
+        Reads the NDSI histograms of the scenes of a path_row from its histogram csv.
+        :param csv_path: Path to the histogram csv.
+        :return: Dictionary with the scene name as key and its histogram, with the border pixels last, as value.
+        """
+        histograms = {}
+        with open(csv_path, newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                bins = sorted((name for name in row if name.startswith('BIN_')), key=lambda name: int(name[4:]))
+                counts = [int(row[name]) for name in bins] + [int(row['BORDER'])]
+                histograms[row['SCENE']] = np.array(counts, dtype=np.int64)
+
+        return histograms
 
     @staticmethod
     def get_snow_image(ndsi, threshold=0.5) -> np.ndarray:
@@ -106,19 +651,17 @@ def image(window_name, image, normalize=True) -> None:
 
 
 if __name__ == "__main__":
-    scene = sc.PathScene("/storage/maria/D/Programming/Facultate/test_27_06/232_083/LC82320832013319LGN01_B3.TIF",
-                         "/storage/maria/D/Programming/Facultate/test_27_06/232_083/LC82320832013319LGN01_B6.TIF")
-    image_16bit = sc.NumpyScene.read(scene)
-    nd = NDSI()
-    ndsi = nd.calculate_NDSI(image_16bit)
-    snow = nd.get_snow_image(ndsi)
-
-    print(nd.get_snow_pixels_ratio(snow))
-
-    image('contrast', snow)
-    while cv2.waitKey() != 27:
-        pass
+    """
+    Computes the snow pixel ratio of a scene without holding its bands in memory, and writes its NDSI image if a third
+    argument is given. With the third argument --sample, the ratio is estimated from a sample of the blocks.
+    """
+    scene = sc.PathScene(sys.argv[1], sys.argv[2])
 
-    image('ndsi', ndsi)
-    while cv2.waitKey() != 27:
-        pass
\ No newline at end of file
+    if len(sys.argv) > 3 and sys.argv[3] == SAMPLE_ARGUMENT:
+        estimate, low, high, read_fraction = NDSI.sample_snow_ratio(scene)
+        print(definitions.PRINT_CODES[2] + "Snow ratio: {:.4f}, {:.0%} confidence interval [{:.4f}, {:.4f}], "
+                                           "{:.1%} of the pixels read".format(estimate, SAMPLE_CONFIDENCE, low, high,
+                                                                               read_fraction))
+    else:
+        output_path = sys.argv[3] if len(sys.argv) > 3 else None
+        print(NDSI.stream_NDSI(scene, ndsi_path=output_path))
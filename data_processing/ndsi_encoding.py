@@ -0,0 +1,176 @@
+"""
+Module which encodes the NDSI images to fixed scale integers and writes them as tiled, compressed GeoTIFFs. The stored
+value v of a pixel gives the NDSI as v * scale + offset; the scale and the offset are written to the GeoTIFF, so that
+the images read back with their absolute values.
+"""
+import sys
+
+import numpy as np
+from osgeo import gdal
+
+sys.path.append(sys.path[0] + '/..')
+import definitions
+
+BORDER_NDSI = -1  # the NDSI of the pixels where a band is 0 valued, which the encodings store as nodata
+
+# the encodings of the NDSI images
+NDSI_ENCODINGS = {
+    # steps of 0.01, the edges of the NDSI histogram bins: v = 100 * (NDSI + 1), from 0 to 200
+    definitions.OUT_TIFF_UINT8: {
+        'dtype': np.uint8,
+        'gdal_type': 'GDT_Byte',
+        'scale': 0.01,
+        'offset': -1.0,
+        'nodata': 255,
+        'predictor': 2
+    },
+    # steps of 0.0001: v = 10000 * NDSI, from -10000 to 10000
+    definitions.OUT_TIFF_INT16: {
+        'dtype': np.int16,
+        'gdal_type': 'GDT_Int16',
+        'scale': 0.0001,
+        'offset': 0.0,
+        'nodata': -32768,
+        'predictor': 2
+    },
+    # the NDSI as it is computed
+    definitions.OUT_TIFF_FLOAT32: {
+        'dtype': np.float32,
+        'gdal_type': 'GDT_Float32',
+        'scale': 1.0,
+        'offset': 0.0,
+        'nodata': BORDER_NDSI,
+        'predictor': 3
+    }
+}
+
+GEOTIFF_DRIVER = 'GTiff'
+GEOTIFF_COMPRESSION = 'DEFLATE'
+GEOTIFF_TILE_SIZE = 256  # the side of the tiles, in pixels
+ENCODING_STRIP_ROWS = GEOTIFF_TILE_SIZE  # the number of rows encoded and written at once, a row of tiles
+
+
+def get_encoding(encoding=None) -> dict:
+    """
+    Returns the description of an encoding.
+    :param encoding: The name of the encoding, None for definitions.NDSI_ENCODING.
+    :return: dict
+    """
+    if encoding is None:
+        encoding = definitions.NDSI_ENCODING
+
+    return NDSI_ENCODINGS[encoding]
+
+
+def encode(ndsi, encoding=None) -> np.ndarray:
+    """
+    Encodes an NDSI image, rounding each value to the nearest step of the encoding. The border pixels, which the NDSI
+    marks with BORDER_NDSI, get the nodata value.
+    :param ndsi: The float NDSI image.
+    :param encoding: The name of the encoding, None for definitions.NDSI_ENCODING.
+    :return: np.ndarray of the type of the encoding.
+    """
+    description = get_encoding(encoding)
+    if description['dtype'] == np.float32:
+        return ndsi.astype(np.float32, copy=False)
+
+    values = np.subtract(ndsi, description['offset'], dtype=np.float32)
+    values /= description['scale']
+    np.rint(values, out=values)
+
+    encoded = values.astype(description['dtype'])
+    encoded[ndsi == BORDER_NDSI] = description['nodata']
+
+    return encoded
+
+
+def create_geotiff(path, width, height, encoding=None, source_dataset=None, window=None):
+    """
+    Creates a tiled, compressed GeoTIFF for an encoded NDSI image, with the scale, offset and nodata of the encoding.
+    The georeferencing of the source band is copied, moved to the window.
+    :param path: Path to the GeoTIFF.
+    :param width: The width of the image.
+    :param height: The height of the image.
+    :param encoding: The name of the encoding, None for definitions.NDSI_ENCODING.
+    :param source_dataset: The GDAL dataset of the band the NDSI is computed from, None for no georeferencing.
+    :param window: The (x offset, y offset, width, height) of the part of the band which is computed, None for all.
+    :return: The GDAL dataset, or None if it cannot be created.
+    """
+    description = get_encoding(encoding)
+
+    driver = gdal.GetDriverByName(GEOTIFF_DRIVER)
+    dataset = driver.Create(path, width, height, 1, getattr(gdal, description['gdal_type']),
+                            ['TILED=YES',
+                             'BLOCKXSIZE=' + str(GEOTIFF_TILE_SIZE),
+                             'BLOCKYSIZE=' + str(GEOTIFF_TILE_SIZE),
+                             'COMPRESS=' + GEOTIFF_COMPRESSION,
+                             'PREDICTOR=' + str(description['predictor'])])
+    if dataset is None:
+        return None
+
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(description['nodata'])
+    band.SetScale(description['scale'])
+    band.SetOffset(description['offset'])
+
+    if source_dataset is not None:
+        x_offset, y_offset = (0, 0) if window is None else window[0:2]
+        geotransform = source_dataset.GetGeoTransform()
+        if geotransform is not None:
+            origin_x, pixel_width, row_rotation, origin_y, column_rotation, pixel_height = geotransform
+            dataset.SetGeoTransform((origin_x + x_offset * pixel_width + y_offset * row_rotation,
+                                     pixel_width, row_rotation,
+                                     origin_y + x_offset * column_rotation + y_offset * pixel_height,
+                                     column_rotation, pixel_height))
+        dataset.SetProjection(source_dataset.GetProjection())
+
+    return dataset
+
+
+def write_geotiff(path, ndsi, encoding=None, source_dataset=None, window=None) -> bool:
+    """
+    Encodes an NDSI image and writes it as a GeoTIFF, a row of tiles at a time, so that only a strip of the encoded
+    image is held in memory.
+    :param path: Path to the GeoTIFF.
+    :param ndsi: The float NDSI image.
+    :param encoding: The name of the encoding, None for definitions.NDSI_ENCODING.
+    :param source_dataset: The GDAL dataset of the band whose pixels the NDSI is in, None for no georeferencing.
+    :param window: The (x offset, y offset, width, height) of the part of the band the NDSI covers, None for all.
+    :return: True if the image was written.
+    """
+    height, width = ndsi.shape
+    dataset = create_geotiff(path, width, height, encoding, source_dataset, window)
+    if dataset is None:
+        return False
+
+    band = dataset.GetRasterBand(1)
+    for start in range(0, height, ENCODING_STRIP_ROWS):
+        band.WriteArray(encode(ndsi[start:start + ENCODING_STRIP_ROWS], encoding), 0, start)
+    dataset.FlushCache()
+
+    return True
+
+
+def read_geotiff(path):
+    """
+    Reads an NDSI GeoTIFF, decoded with its scale, offset and nodata.
+    :param path: Path to the GeoTIFF.
+    :return: The float32 NDSI image, with BORDER_NDSI on the border pixels, or None if it cannot be read.
+    """
+    dataset = gdal.Open(path)
+    if dataset is None:
+        return None
+
+    band = dataset.GetRasterBand(1)
+    values = band.ReadAsArray()
+    if values is None:
+        return None
+
+    ndsi = values.astype(np.float32)
+    ndsi *= band.GetScale() or 1.0
+    ndsi += band.GetOffset() or 0.0
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        ndsi[values == nodata] = BORDER_NDSI
+
+    return ndsi
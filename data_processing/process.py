@@ -37,22 +37,31 @@ class Process:
     Class which handles processing of the input directories.
     """
 
-    def __init__(self, big_glacier_dir, glacier_dir, output_dir, max_processes=definitions.MAX_PROCESSES):
+    def __init__(self, big_glacier_dir, glacier_dir, output_dir, max_processes=definitions.MAX_PROCESSES,
+                 backend=definitions.DEFAULT_BACKEND, output_mode=definitions.DEFAULT_OUTPUT_MODE):
         """
         The constructor of the Process class.
         :param glacier_dir: The glacier directory.
         :param big_glacier_dir: The directory which contains more glacier directories.
         :param output_dir: The directory assigned for processing writing.
         :param max_processes: Number of processes the application works with.
+        :param backend: How the scenes are processed: one subprocess per scene, or a pool of long lived workers.
+        :param output_mode: Whether the warped images or only the transform of each scene are written.
         """
         self.glacier_dir = glacier_dir
         self.big_glacier_dir = big_glacier_dir
         self.output_dir = output_dir
 
         self.max_processes = max_processes
+        self.backend = backend
+        self.output_mode = output_mode
 
-        self.mh = mh.Multiprocess(max_processes=self.max_processes,
-                                  handler=self.process_handler)
+        if self.backend == definitions.POOL_BACKEND:
+            self.mh = mh.WorkerPool(max_processes=self.max_processes,
+                                    handler=self.process_handler)
+        else:
+            self.mh = mh.Multiprocess(max_processes=self.max_processes,
+                                      handler=self.process_handler)
         self.VALID_ALIGNED = 0
         self.TOTAL_PROCESSED = 0
 
@@ -66,6 +75,8 @@ class Process:
         else:
             self.parse_directory(self.glacier_dir)
 
+        self.mh.close()
+
     def parse_directories(self) -> None:
         """
         Parses all the subdirectories of the big directory.
@@ -138,12 +149,20 @@ class Process:
         """
 
         try:
-            task = ["python3", "data_processing/alignment_ORB.py",
-                    scene.green_path, scene.swir1_path,
-                    reference_scene.green_path, reference_scene.swir1_path,
-                    aligned_scene.green_path, aligned_scene.swir1_path]
+            if self.backend == definitions.POOL_BACKEND:
+                # imported here so that the subprocess backend does not load OpenCV in the parent process
+                from data_processing import alignment_ORB as al
+
+                self.mh.start_processing(task=al.align_scene_task, task_name=scene.get_scene_name(),
+                                         args=(scene, reference_scene, aligned_scene, self.output_mode))
+            else:
+                task = ["python3", "data_processing/alignment_ORB.py",
+                        scene.green_path, scene.swir1_path,
+                        reference_scene.green_path, reference_scene.swir1_path,
+                        aligned_scene.green_path, aligned_scene.swir1_path,
+                        self.output_mode]
 
-            self.mh.start_processing(task=task, task_name=scene.get_scene_name(), ignore_SIGINT=True)
+                self.mh.start_processing(task=task, task_name=scene.get_scene_name(), ignore_SIGINT=True)
 
         except KeyboardInterrupt:
             print(definitions.PRINT_CODES[1] + yellow("Keyboard interrupt."))
@@ -297,11 +316,15 @@ if __name__ == "__main__":
     glacier_dir = sys.argv[2]
     output_dir = sys.argv[3]
     max_processes = int(sys.argv[4])
+    backend = sys.argv[5] if len(sys.argv) > 5 else definitions.DEFAULT_BACKEND
+    output_mode = sys.argv[6] if len(sys.argv) > 6 else definitions.DEFAULT_OUTPUT_MODE
 
     signal.signal(signal.SIGINT, interrupt_handler)
 
     process_align = Process(big_glacier_dir=big_glacier_dir,
                             glacier_dir=glacier_dir,
                             output_dir=output_dir,
-                            max_processes=max_processes)
+                            max_processes=max_processes,
+                            backend=backend,
+                            output_mode=output_mode)
     process_align.start()
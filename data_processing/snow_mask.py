@@ -0,0 +1,206 @@
+"""
+Module which stores the snow masks of the aligned scenes packed to one bit per pixel, and computes the snow statistics
+of a path_row from them with bitwise operations and population counts over 64 bit words, without unpacking the masks.
+"""
+import csv
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(sys.path[0] + '/..')
+import definitions
+from data_processing import ndsi as nc
+
+# the classes of the snow class image, which is warped with the nearest neighbour, so that the pixels outside the warped
+# scene get NO_DATA_CLASS
+NO_DATA_CLASS = nc.NO_DATA_CLASS
+GROUND_CLASS = nc.GROUND_CLASS
+SNOW_CLASS = nc.SNOW_CLASS
+
+WORD_BYTES = 8  # the packed masks are padded to whole np.uint64 words
+# the number of set bits of each byte, for the numpy versions without np.bitwise_count
+BYTE_POPCOUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def snow_classes(numpy_scene, threshold=0.5) -> np.ndarray:
+    """
+    Classifies the pixels of a scene with the integer test of SnowMaskStrip, see NDSI.get_snow_statistics.
+    :param numpy_scene: Satellite image containing green and swir1 np images.
+    :param threshold: The threshold for calculating the number of snow pixels.
+    :return: The uint8 image of the classes: NO_DATA_CLASS where a band is 0 valued, SNOW_CLASS or GROUND_CLASS.
+    """
+    return nc.NDSI.get_snow_statistics(numpy_scene, threshold, classes=True)['classes']
+
+
+def pack(mask) -> np.ndarray:
+    """
+    Packs a boolean mask to one bit per pixel, in row major order, padded with zeros to whole words.
+    :param mask: The boolean mask.
+    :return: The np.uint64 words.
+    """
+    packed = np.packbits(mask, axis=None)
+    padded = np.zeros(-(-packed.size // WORD_BYTES) * WORD_BYTES, dtype=np.uint8)
+    padded[:packed.size] = packed
+
+    return padded.view(np.uint64)
+
+
+def popcount(words) -> int:
+    """
+    Counts the set bits of packed words.
+    :param words: The np.uint64 words.
+    :return: int
+    """
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+
+    return int(BYTE_POPCOUNTS[words.view(np.uint8)].sum(dtype=np.int64))
+
+
+class PackedSnowMask:
+    """
+    Class which holds the packed snow and valid pixel masks of an aligned scene. A snow pixel is always valid.
+    """
+
+    def __init__(self, snow_words, valid_words, shape):
+        """
+        Initializes the masks.
+        :param snow_words: The packed mask of the snow pixels.
+        :param valid_words: The packed mask of the valid pixels, where the scene has data and no band is 0 valued.
+        :param shape: The (height, width) of the masks.
+        """
+        self.snow_words = snow_words
+        self.valid_words = valid_words
+        self.shape = tuple(int(side) for side in shape)
+
+    @staticmethod
+    def from_classes(classes):
+        """
+        Packs the masks of a snow class image.
+        :param classes: The uint8 image of the classes.
+        :return: PackedSnowMask
+        """
+        return PackedSnowMask(pack(classes == SNOW_CLASS), pack(classes != NO_DATA_CLASS), classes.shape)
+
+    def snow_pixels(self) -> int:
+        """
+        Counts the snow pixels.
+        :return: int
+        """
+        return popcount(self.snow_words)
+
+    def valid_pixels(self) -> int:
+        """
+        Counts the valid pixels.
+        :return: int
+        """
+        return popcount(self.valid_words)
+
+    def unpack(self) -> tuple:
+        """
+        Unpacks the masks.
+        :return: The boolean snow and valid masks.
+        """
+        size = self.shape[0] * self.shape[1]
+        return tuple(np.unpackbits(words.view(np.uint8), count=size).reshape(self.shape).view(bool)
+                     for words in (self.snow_words, self.valid_words))
+
+    def write(self, mask_path) -> None:
+        """
+        Writes the masks as a compressed npz file, under a temporary name which is then renamed.
+        :param mask_path: Path to the npz file.
+        :return: None
+        """
+        temporary_path = mask_path + ".tmp.npz"
+        np.savez_compressed(temporary_path, snow=self.snow_words, valid=self.valid_words, shape=np.array(self.shape))
+        os.replace(temporary_path, mask_path)
+
+    @staticmethod
+    def read(mask_path):
+        """
+        Reads the masks written by write.
+        :param mask_path: Path to the npz file.
+        :return: PackedSnowMask, or None if the file cannot be read.
+        """
+        try:
+            with np.load(mask_path) as data:
+                return PackedSnowMask(data['snow'], data['valid'], data['shape'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def snow_change(first: PackedSnowMask, second: PackedSnowMask) -> dict:
+    """
+    Compares the snow of two dates over the pixels which are valid in both.
+    :param first: The masks of the earlier scene.
+    :param second: The masks of the later scene.
+    :return: Dictionary with the number of pixels valid in both scenes, and of the snow pixels gained and lost.
+    """
+    if first.shape != second.shape:
+        raise ValueError("The snow masks have different shapes: " + str(first.shape) + " and " + str(second.shape))
+
+    common = first.valid_words & second.valid_words
+    # a snow pixel is valid, so the snow of one scene on the common pixels is the snow which is valid in the other
+    first_snow = first.snow_words & second.valid_words
+    second_snow = second.snow_words & first.valid_words
+
+    return {
+        'valid': popcount(common),
+        'gained': popcount(second_snow & ~first_snow),
+        'lost': popcount(first_snow & ~second_snow)
+    }
+
+
+def snow_frequency(masks) -> tuple:
+    """
+    Counts, for each pixel, the dates on which it is snow and the dates on which it is valid. The masks are unpacked one
+    at a time.
+    :param masks: The PackedSnowMask of each date, all of the same shape.
+    :return: The uint16 images of the snow and of the valid date counts; their ratio is the snow frequency.
+    """
+    snow_dates = np.zeros(masks[0].shape, dtype=np.uint16)
+    valid_dates = np.zeros(masks[0].shape, dtype=np.uint16)
+    for mask in masks:
+        snow, valid = mask.unpack()
+        snow_dates += snow
+        valid_dates += valid
+
+    return snow_dates, valid_dates
+
+
+def find_snow_masks(path_row_dir) -> list:
+    """
+    Finds the snow masks of a path_row output directory, ordered by scene name, so by date for a path_row.
+    :param path_row_dir: The path_row output directory.
+    :return: The sorted list of paths.
+    """
+    return sorted(os.path.join(path_row_dir, name) for name in os.listdir(path_row_dir)
+                  if name.endswith(definitions.SNOW_MASK_END))
+
+
+if __name__ == "__main__":
+    """
+    Prints, as csv, the snow and valid pixels of each scene of the path_row output directory given as argument, and the
+    snow pixels gained and lost since the previous scene.
+    """
+    mask_paths = find_snow_masks(sys.argv[1])
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['scene', 'snow_pixels', 'valid_pixels', 'common_valid_pixels', 'gained', 'lost'])
+    previous = None
+    for mask_path in mask_paths:
+        current = PackedSnowMask.read(mask_path)
+        if current is None:
+            continue
+
+        scene_name = os.path.basename(mask_path)[:-len(definitions.SNOW_MASK_END)]
+        row = [scene_name, current.snow_pixels(), current.valid_pixels()]
+        if previous is not None and previous.shape == current.shape:
+            change = snow_change(previous, current)
+            row += [change['valid'], change['gained'], change['lost']]
+        else:
+            row += ['', '', '']
+
+        writer.writerow(row)
+        previous = current
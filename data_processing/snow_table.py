@@ -0,0 +1,225 @@
+"""
+Module which holds the summed-area tables of the snow pixels and of the valid pixels of a scene, counted per block, so
+that the snow ratio of any box of the scene is found with four lookups in each table. The tables are written next to the
+outputs of each scene, and the snow ratios of all the glaciers of the inventory are queried from them for every scene,
+without reading the bands again.
+"""
+import csv
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(sys.path[0] + '/..')
+import definitions
+from colors import *
+from data_processing import georeference as geo
+
+GLACIER_BOX_SIZE = 64  # the side of the box around the coordinates of a glacier, in pixels
+
+
+class SnowTable:
+    """
+    Class which holds the summed-area tables of a scene. table[i, j] is the number of pixels of the blocks above row i
+    and left of column j, so the tables have a row and a column of zeros more than there are blocks.
+    """
+
+    def __init__(self, snow_table, valid_table, block, band_path, window=None):
+        """
+        Initializes the tables.
+        :param snow_table: The summed-area table of the snow pixels.
+        :param valid_table: The summed-area table of the valid pixels, where no band is 0 valued.
+        :param block: The side of the blocks, in pixels.
+        :param band_path: Path to the green band the tables are computed from, whose georeferencing the queries use.
+        :param window: The (x offset, y offset, width, height) of the part of the band which is counted, None for all.
+        """
+        self.snow_table = snow_table
+        self.valid_table = valid_table
+        self.block = block
+        self.band_path = band_path
+        self.window = window
+
+    @staticmethod
+    def from_counts(snow_counts, valid_counts, block, band_path, window=None):
+        """
+        Creates the tables from the pixel counts of the blocks.
+        :param snow_counts: The snow pixel count of each block.
+        :param valid_counts: The valid pixel count of each block.
+        :param block: The side of the blocks, in pixels.
+        :param band_path: Absolute path to the green band the counts are computed from, so that the tables are queried
+        from any working directory.
+        :param window: The (x offset, y offset, width, height) of the part of the band which is counted, None for all.
+        :return: SnowTable
+        """
+        tables = []
+        for counts in (snow_counts, valid_counts):
+            table = np.zeros((counts.shape[0] + 1, counts.shape[1] + 1), dtype=np.int32)
+            np.cumsum(counts, axis=0, out=table[1:, 1:])
+            np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+            tables.append(table)
+
+        return SnowTable(tables[0], tables[1], block, band_path, window)
+
+    def count(self, x_start, y_start, x_end, y_end) -> tuple:
+        """
+        Counts the snow and the valid pixels of a box of the tables. The box is given in pixels of the band and is
+        rounded to the nearest block edges, and cut by the tables.
+        :param x_start: The left edge of the box.
+        :param y_start: The top edge of the box.
+        :param x_end: The right edge of the box.
+        :param y_end: The bottom edge of the box.
+        :return: The number of snow pixels and the number of valid pixels of the box.
+        """
+        x_offset, y_offset = (0, 0) if self.window is None else self.window[0:2]
+        rows, columns = self.snow_table.shape
+
+        column_start, column_end = (int(np.clip(round((x - x_offset) / self.block), 0, columns - 1))
+                                    for x in (x_start, x_end))
+        row_start, row_end = (int(np.clip(round((y - y_offset) / self.block), 0, rows - 1))
+                              for y in (y_start, y_end))
+
+        return tuple(int(table[row_end, column_end] - table[row_start, column_end] -
+                         table[row_end, column_start] + table[row_start, column_start])
+                     for table in (self.snow_table, self.valid_table))
+
+    def snow_ratio(self, x_start, y_start, x_end, y_end):
+        """
+        Returns the ratio of the snow pixels to the valid pixels of a box of the tables.
+        :param x_start: The left edge of the box.
+        :param y_start: The top edge of the box.
+        :param x_end: The right edge of the box.
+        :param y_end: The bottom edge of the box.
+        :return: The snow ratio, or None if the box has no valid pixels.
+        """
+        snow, valid = self.count(x_start, y_start, x_end, y_end)
+        if valid == 0:
+            return None
+
+        return snow / valid
+
+    def glacier_snow_ratios(self, glaciers, box_size=GLACIER_BOX_SIZE) -> dict:
+        """
+        Returns the snow ratio of the box around each glacier which is inside the scene. The coordinates of all the
+        glaciers are converted with a single read of the band header.
+        :param glaciers: List of (glacier id, lon, lat) tuples.
+        :param box_size: The side of the box around the coordinates of a glacier, in pixels.
+        :return: Dictionary with the glacier ids as keys and the snow ratios as values. The glaciers outside the
+        scene, or whose box has no valid pixels, are left out. It is empty, with an error printed, if the band cannot be
+        georeferenced.
+        """
+        pixels = geo.lonlat_to_pixels(self.band_path, [(lon, lat) for glacier_id, lon, lat in glaciers])
+        if pixels is None:
+            # printed to stderr, so that the csv written to stdout stays clean
+            print(red("[ ERROR ] ") + "Cannot georeference the snow table with the band " + self.band_path,
+                  file=sys.stderr)
+            return {}
+
+        x_offset, y_offset = (0, 0) if self.window is None else self.window[0:2]
+        width = (self.snow_table.shape[1] - 1) * self.block
+        height = (self.snow_table.shape[0] - 1) * self.block
+
+        ratios = {}
+        for (glacier_id, lon, lat), (x, y) in zip(glaciers, pixels):
+            if not (x_offset <= x < x_offset + width and y_offset <= y < y_offset + height):
+                continue
+
+            ratio = self.snow_ratio(x - box_size / 2, y - box_size / 2, x + box_size / 2, y + box_size / 2)
+            if ratio is not None:
+                ratios[glacier_id] = ratio
+
+        return ratios
+
+    def write(self, table_path) -> None:
+        """
+        Writes the tables as a compressed npz file, under a temporary name which is then renamed.
+        :param table_path: Path to the npz file.
+        :return: None
+        """
+        temporary_path = table_path + ".tmp.npz"
+        np.savez_compressed(temporary_path,
+                            snow_table=self.snow_table,
+                            valid_table=self.valid_table,
+                            block=self.block,
+                            band_path=self.band_path,
+                            window=np.array([] if self.window is None else self.window, dtype=np.int64))
+        os.replace(temporary_path, table_path)
+
+    @staticmethod
+    def read(table_path):
+        """
+        Reads the tables written by write.
+        :param table_path: Path to the npz file.
+        :return: SnowTable, or None if the file cannot be read.
+        """
+        try:
+            with np.load(table_path) as data:
+                window = tuple(int(value) for value in data['window']) or None
+                return SnowTable(data['snow_table'], data['valid_table'], int(data['block']),
+                                 str(data['band_path']), window)
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def read_glacier_inventory(csv_path=definitions.GLACIER_DATASET_PATH) -> list:
+    """
+    Reads the ids and coordinates of the glaciers of the inventory.
+    :param csv_path: Path to the glacier csv.
+    :return: List of (glacier id, lon, lat) tuples.
+    """
+    glaciers = []
+    with open(csv_path, 'r', newline='', encoding='ISO-8859-1') as csv_file:
+        for row in csv.DictReader(csv_file):
+            # some versions of the inventory have a space before the coordinate column names
+            lon = row['lon'] if 'lon' in row else row[' lon']
+            lat = row['lat'] if 'lat' in row else row[' lat']
+            glaciers.append((row['wgi_glacier_id'], float(lon), float(lat)))
+
+    return glaciers
+
+
+def find_snow_tables(directory) -> list:
+    """
+    Finds the snow tables written under a directory, e.g. a glacier or a path_row output directory.
+    :param directory: The directory searched recursively.
+    :return: The sorted list of paths.
+    """
+    table_paths = []
+    for root, dirs, files in os.walk(directory):
+        table_paths += [os.path.join(root, name) for name in files if name.endswith(definitions.SNOW_TABLE_END)]
+
+    return sorted(table_paths)
+
+
+def query_snow_ratios(table_paths, glaciers, box_size=GLACIER_BOX_SIZE) -> dict:
+    """
+    Queries the snow ratios of the glaciers from the snow tables of the scenes.
+    :param table_paths: The paths to the snow tables.
+    :param glaciers: List of (glacier id, lon, lat) tuples.
+    :param box_size: The side of the box around the coordinates of a glacier, in pixels.
+    :return: Dictionary with the scene names as keys and the glacier_snow_ratios dictionaries as values.
+    """
+    ratios = {}
+    for table_path in table_paths:
+        table = SnowTable.read(table_path)
+        if table is None:
+            continue
+
+        scene_name = os.path.basename(table_path)[:-len(definitions.SNOW_TABLE_END)]
+        ratios[scene_name] = table.glacier_snow_ratios(glaciers, box_size)
+
+    return ratios
+
+
+if __name__ == "__main__":
+    """
+    Prints, as csv, the snow ratio of each glacier of the inventory for each scene whose snow table is under the
+    directory given as the first argument. The inventory is the second argument, or the default glacier dataset.
+    """
+    inventory = read_glacier_inventory(*sys.argv[2:3])
+    scene_ratios = query_snow_ratios(find_snow_tables(sys.argv[1]), inventory)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['scene', 'wgi_glacier_id', 'snow_ratio'])
+    for scene_name, glacier_ratios in scene_ratios.items():
+        for wgi_glacier_id, snow_ratio in glacier_ratios.items():
+            writer.writerow([scene_name, wgi_glacier_id, snow_ratio])
@@ -0,0 +1,208 @@
+"""
+Module which tunes the alignment parameters on synthetic scene pairs with a known affine transformation, created from
+real bands, and writes the Pareto optimal configurations as a profile which the alignment loads.
+"""
+import itertools
+import json
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(sys.path[0] + '/..')
+import definitions
+from data_processing import alignment_ORB as al
+from data_processing import benchmark as bm
+
+from colors import *
+
+# the values swept for each parameter; the grid is square, so ROWS_NUMBER and COLUMNS_NUMBER take the same value
+MAX_FEATURES_VALUES = (1500, 3000, 5000)
+GOOD_MATCH_PERCENT_VALUES = (0.10, 0.25)
+GRID_SIZE_VALUES = (4, 8)
+
+
+def configurations() -> list:
+    """
+    Returns all the combinations of the swept parameter values.
+    :return: List of dictionaries with the alignment setting names as keys.
+    """
+    return [{
+        'MAX_FEATURES': max_features,
+        'GOOD_MATCH_PERCENT': good_match_percent,
+        'ROWS_NUMBER': grid_size,
+        'COLUMNS_NUMBER': grid_size
+    } for max_features, good_match_percent, grid_size in itertools.product(MAX_FEATURES_VALUES,
+                                                                            GOOD_MATCH_PERCENT_VALUES,
+                                                                            GRID_SIZE_VALUES)]
+
+
+def dominates(first, second) -> bool:
+    """
+    Checks if a configuration is at least as good as another in time, success rate and error, and better in one.
+    :param first: The summary of the first configuration.
+    :param second: The summary of the second configuration.
+    :return: bool
+    """
+    first_scores = (first['time'], -first['success_rate'], first['median_error'])
+    second_scores = (second['time'], -second['success_rate'], second['median_error'])
+
+    return all(a <= b for a, b in zip(first_scores, second_scores)) and first_scores != second_scores
+
+
+def pareto_front(summaries) -> list:
+    """
+    Keeps the configurations which no other configuration dominates, sorted by time.
+    :param summaries: The summaries of the configurations.
+    :return: list
+    """
+    front = [summary for summary in summaries
+             if not any(dominates(other, summary) for other in summaries)]
+
+    return sorted(front, key=lambda summary: summary['time'])
+
+
+class ParameterTuning:
+    """
+    Class which aligns the same synthetic pairs with each configuration of the swept parameters, measuring the
+    alignment time, the success rate and the transform error.
+    """
+
+    def __init__(self, seed_paths, pairs_per_seed=bm.PAIRS_PER_SEED):
+        """
+        Initializes the tuning.
+        :param seed_paths: List of (green path, swir1 path) tuples of the seed scenes.
+        :param pairs_per_seed: The number of synthetic pairs created from each seed.
+        """
+        self.seed_paths = seed_paths
+        self.pairs_per_seed = pairs_per_seed
+
+    def start(self) -> list:
+        """
+        Runs the sweep and prints the summary of each configuration.
+        :return: The list of summaries, with the parameters, mean time, success rate and median error.
+        """
+        tuned = configurations()
+        results = [{'times': [], 'successes': [], 'errors': []} for parameters in tuned]
+
+        for green_path, swir1_path in self.seed_paths:
+            print(definitions.PRINT_CODES[0] + "Seed: " + green_path)
+            seed = bm.read_seed(green_path, swir1_path)
+            pairs = list(bm.make_synthetic_pairs(seed, self.pairs_per_seed))
+
+            for parameters, result in zip(tuned, results):
+                self.run_configuration(parameters, pairs, result)
+
+        summaries = [self.summarize(parameters, result) for parameters, result in zip(tuned, results)]
+        self.print_results(summaries)
+
+        return summaries
+
+    @staticmethod
+    def run_configuration(parameters, pairs, result) -> None:
+        """
+        Aligns the pairs with the alignment settings set to the parameters and to benchmark.MEASURED_SETTINGS,
+        restoring the settings afterwards.
+        :param parameters: The alignment settings of the configuration.
+        :param pairs: List of (image, reference, affine) synthetic pairs.
+        :param result: The times, successes and errors of the configuration, which are appended to.
+        :return: None
+        """
+        initial = bm.apply_settings(dict(bm.MEASURED_SETTINGS, **parameters))
+
+        try:
+            for image, reference, truth in pairs:
+                # the reference is described once for a path_row, so its cost is not part of the alignment time
+                reference_features = al.AlignORB.describe_reference(reference)
+                height, width = image.green_numpy.shape
+
+                start = time.perf_counter()
+                affine = al.AlignORB(image, reference_features=reference_features).get_align_affine_transformation()
+                result['times'].append(time.perf_counter() - start)
+
+                if affine is None:
+                    result['successes'].append(False)
+                    continue
+
+                error = bm.transform_error(affine, truth, width, height)
+                result['errors'].append(error)
+                result['successes'].append(error <= bm.ALLOWED_ERROR)
+        finally:
+            bm.apply_settings(initial)
+
+    @staticmethod
+    def summarize(parameters, result) -> dict:
+        """
+        Reduces the measurements of a configuration to its mean time, success rate and median error. A configuration
+        without any affine has an infinite error.
+        :param parameters: The alignment settings of the configuration.
+        :param result: The times, successes and errors of the configuration.
+        :return: dict
+        """
+        return {
+            'parameters': parameters,
+            'time': float(np.mean(result['times'])),
+            'success_rate': float(np.mean(result['successes'])),
+            'median_error': float(np.median(result['errors'])) if len(result['errors']) > 0 else float('inf')
+        }
+
+    @staticmethod
+    def write_profile(summaries, profile_path) -> dict:
+        """
+        Writes the profile: the Pareto front of the configurations, and as the parameters loaded by the alignment, the
+        front configuration with the highest success rate, the fastest of them if there are several.
+        :param summaries: The summaries of the configurations.
+        :param profile_path: Path to the json profile.
+        :return: The chosen summary.
+        """
+        front = pareto_front(summaries)
+        chosen = min(front, key=lambda summary: (-summary['success_rate'], summary['time']))
+
+        profile = {
+            'parameters': chosen['parameters'],
+            'time': chosen['time'],
+            'success_rate': chosen['success_rate'],
+            'median_error': chosen['median_error'],
+            'pareto_front': front
+        }
+
+        with open(profile_path, 'w') as profile_file:
+            json.dump(profile, profile_file, indent=4)
+
+        return chosen
+
+    @staticmethod
+    def print_results(summaries) -> None:
+        """
+        Prints the mean time, the success rate and the median error of each configuration, marking the Pareto optimal
+        ones.
+        :param summaries: The summaries of the configurations.
+        :return: None
+        """
+        front = pareto_front(summaries)
+
+        print(definitions.PRINT_CODES[2] + "FEATURES  GOOD MATCH  GRID   MEAN TIME   SUCCESS   MEDIAN ERROR")
+        for summary in summaries:
+            parameters = summary['parameters']
+            line = "{:>8}  {:>10.2f}  {:>4}  {:>8.2f}s   {:>6.1%}   {:>9.2f}px".format(parameters['MAX_FEATURES'],
+                                                                                      parameters['GOOD_MATCH_PERCENT'],
+                                                                                      parameters['ROWS_NUMBER'],
+                                                                                      summary['time'],
+                                                                                      summary['success_rate'],
+                                                                                      summary['median_error'])
+            print(green(line + "  pareto") if summary in front else blue(line))
+
+
+if __name__ == "__main__":
+    """
+    Tune the alignment on the green bands given as arguments; the swir1 band is taken from the same directory. The
+    profile is written to definitions.ALIGNMENT_PROFILE_PATH, from where the alignment loads it.
+    """
+    seeds = []
+    for green_band in sys.argv[1:]:
+        swir1_band = green_band.replace(definitions.GREEN_BAND_END, definitions.SWIR1_BAND_END)
+        seeds.append((green_band, swir1_band))
+
+    tuning = ParameterTuning(seeds)
+    chosen_summary = ParameterTuning.write_profile(tuning.start(), definitions.ALIGNMENT_PROFILE_PATH)
+    print(definitions.PRINT_CODES[2] + "Profile: " + str(chosen_summary['parameters']))
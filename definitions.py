@@ -18,22 +18,29 @@ GLACIER_DATASET_PATH = os.path.join(FILES_DIR,
 JSON_QUERY = 'query.json'
 DEFAULT_SCENE_NAME = None
 DEFAULT_BIG_DIR = None
+CACHE_DIR = '.cache'
 
 # bands
 GREEN_BAND_END = '_B3.TIF'
 SWIR1_BAND_END = '_B6.TIF'
 METADATA_END = "_MTL.txt"
+NDSI_END = "_NDSI.TIF"
+TRANSFORM_END = "_AFFINE.json"
+SNOW_TABLE_END = "_SNOW_TABLE.npz"
+SNOW_MASK_END = "_SNOW_MASK.npz"
 BAND_OPTIONS = (GREEN_BAND_END, SWIR1_BAND_END)
 
 # ndsi
 THRESHOLD = 12000
-OUT_TIFF_UINT8 = str(THRESHOLD) + "_NDSI_INT8.tif"
-OUT_TIFF_UINT16 = str(THRESHOLD) + "_NDSI_INT16.tif"
-OUT_TIFF_FLOAT32 = str(THRESHOLD) + "_NDSI_FLOAT32.tif"
+OUT_TIFF_UINT8 = 'uint8'  # the NDSI encodings of the images, described in data_processing/ndsi_encoding.py
+OUT_TIFF_INT16 = 'int16'
+OUT_TIFF_FLOAT32 = 'float32'
+NDSI_ENCODING = OUT_TIFF_INT16
+SNOW_TABLE_BLOCK = 16  # the side of the blocks the snow tables count the pixels of, the resolution of their queries
+NDSI_HISTOGRAM_BINS = 200  # the number of NDSI histogram bins over [-1, 1], so that the bin edges are multiples of 0.01
 
-# align
-MAX_FEATURES = 1500
-GOOD_MATCH_PERCENT = 0.10
+# align, the alignment parameters are in data_processing/alignment_ORB.py
+ALIGNMENT_PROFILE_PATH = os.path.join(FILES_DIR, 'alignment_profile.json')  # written by data_processing/tuning.py
 ALLOWED_ERROR = 0.05
 ALLOWED_INTEGRAL = 100
 
@@ -47,6 +54,14 @@ BBOX_SIZE = 0.00001
 
 # processing
 MAX_PROCESSES = 4
+SUBPROCESS_BACKEND = 'subprocess'  # one python interpreter per scene
+POOL_BACKEND = 'pool'  # long lived worker processes which take the scenes as function calls
+BACKENDS = (SUBPROCESS_BACKEND, POOL_BACKEND)
+DEFAULT_BACKEND = SUBPROCESS_BACKEND
+RASTER_OUTPUT = 'raster'  # write the warped green, swir1 and NDSI images
+TRANSFORM_OUTPUT = 'transform'  # write only the affine of each scene, the bands are warped when they are read
+OUTPUT_MODES = (RASTER_OUTPUT, TRANSFORM_OUTPUT)
+DEFAULT_OUTPUT_MODE = RASTER_OUTPUT
 RETURN_CODES = {
     0: (colors.green("SUCCESS. ")),
     1: (colors.red("FAILURE. ")),
@@ -0,0 +1,108 @@
+"""
+Tests of the integer snow test of SnowMaskStrip against the comparison of the float NDSI with the threshold, on a
+synthetic 16 bit band pair with border pixels and pixels on the threshold.
+"""
+import os
+import sys
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data_processing import ndsi as nc
+from data_processing import scenes as sc
+
+SIZE = 256  # the side of the synthetic bands, in pixels
+EDGE_DENOMINATOR = 100  # the largest denominator of the fraction the threshold edge pixels are placed on
+THRESHOLDS = [0.5, 0.4, 0.3, 0.1234, 0.1, 0.0, -0.25, 0.77, 0.9]  # the float thresholds the pipeline passes
+
+
+def synthetic_band_pair(threshold, seed=0) -> tuple:
+    """
+    Creates a 16 bit band pair with random pixels, outer rows and columns 0 valued in both bands, like the border of an
+    aligned scene, some pixels 0 valued in a single band, and rows of threshold edge pixels: their NDSI is the fraction
+    p / q nearest to the threshold with q up to EDGE_DENOMINATOR, or the nearest NDSI value on either side of it.
+    :param threshold: The threshold in (-1, 1) the edge pixels are placed around.
+    :param seed: The seed of the random pixels.
+    :return: The NumpyScene of the bands, and the boolean masks of the border and of the threshold edge pixels.
+    """
+    rng = np.random.default_rng(seed)
+    green = rng.integers(1, nc.BAND_MAX_VALUE, (SIZE, SIZE), endpoint=True).astype(np.uint16)
+    swir = rng.integers(1, nc.BAND_MAX_VALUE, (SIZE, SIZE), endpoint=True).astype(np.uint16)
+    green[rng.random((SIZE, SIZE)) < 0.01] = 0
+    swir[rng.random((SIZE, SIZE)) < 0.01] = 0
+
+    # the NDSI of green = k * (q + p) + step and swir = k * (q - p) is p / q for step 0, and next to it otherwise
+    fraction = Fraction(threshold).limit_denominator(EDGE_DENOMINATOR)
+    green_factor = fraction.denominator + fraction.numerator
+    swir_factor = fraction.denominator - fraction.numerator
+    multiples = np.arange(1, (nc.BAND_MAX_VALUE - 1) // max(green_factor, swir_factor) + 1)
+    multiples = np.resize(multiples, (SIZE // 16, SIZE))
+
+    edge = np.zeros((SIZE, SIZE), dtype=bool)
+    for band_row, step in enumerate((-1, 0, 1)):
+        rows = slice(SIZE // 2 + band_row * len(multiples), SIZE // 2 + (band_row + 1) * len(multiples))
+        green[rows] = multiples * green_factor + step
+        swir[rows] = multiples * swir_factor
+        edge[rows] = True
+
+    for band in (green, swir, edge):
+        band[[0, -1]] = 0
+        band[:, [0, -1]] = 0
+    border = np.logical_not(np.logical_and(green, swir))
+
+    return sc.NumpyScene(green, swir), border, edge
+
+
+def integer_snow(numpy_scene, threshold) -> np.ndarray:
+    """
+    Classifies the pixels of a scene with the integer snow test, in strips as the statistics do.
+    :param numpy_scene: The scene.
+    :param threshold: The threshold for the snow pixels.
+    :return: The boolean snow mask.
+    """
+    green = numpy_scene.green_numpy
+    swir = numpy_scene.swir1_numpy
+    strip = nc.SnowMaskStrip(nc.NDSI_STRIP_ROWS, green.shape[1], threshold)
+
+    snow = np.empty(green.shape, dtype=bool)
+    for start in range(0, green.shape[0], nc.NDSI_STRIP_ROWS):
+        strip_snow, strip_snow_pixels = strip.compute(green[start:start + nc.NDSI_STRIP_ROWS],
+                                                      swir[start:start + nc.NDSI_STRIP_ROWS])
+        snow[start:start + len(strip_snow)] = strip_snow
+
+    return snow
+
+
+@pytest.mark.parametrize('threshold', THRESHOLDS)
+@pytest.mark.parametrize('float_dtype', [np.float32, np.float64])
+def test_integer_snow_test_matches_float_ndsi(threshold, float_dtype):
+    numpy_scene, border, edge = synthetic_band_pair(threshold)
+    assert np.count_nonzero(edge) > 0
+
+    ndsi = nc.NDSI.calculate_NDSI(numpy_scene, math_dtype=float_dtype)
+    mismatches = integer_snow(numpy_scene, threshold) != (ndsi > threshold)
+
+    assert np.count_nonzero(mismatches & border) == 0
+    assert np.count_nonzero(mismatches & edge) == 0
+    assert np.count_nonzero(mismatches) == 0
+
+
+@pytest.mark.parametrize('threshold', [Fraction(1, 3), Fraction(3, 10), Fraction(196603, 196605), -1.0, 1.0, 2.0])
+def test_integer_snow_test_is_exact_for_fractions(threshold):
+    numpy_scene, border, edge = synthetic_band_pair(min(max(threshold, -0.99), 0.99), seed=1)
+    green = numpy_scene.green_numpy.astype(np.int64)
+    swir = numpy_scene.swir1_numpy.astype(np.int64)
+
+    # NDSI > p / q is q * (green - swir) > p * (green + swir) on the valid pixels, and -1 > p / q on the border
+    fraction = Fraction(threshold)
+    expected = fraction.denominator * (green - swir) > fraction.numerator * (green + swir)
+    expected[border] = -1 > fraction
+
+    np.testing.assert_array_equal(integer_snow(numpy_scene, threshold), expected)
+
+
+def test_integer_snow_test_buffers_fit_the_threshold():
+    assert nc.SnowMaskStrip(1, 1, 0.5).green.dtype == np.int32
+    assert nc.SnowMaskStrip(1, 1, 0.1234567).green.dtype == np.int64
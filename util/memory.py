@@ -0,0 +1,37 @@
+"""
+Module which measures the memory of the current process, from the Linux /proc file system.
+"""
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+PEAK_RSS_FIELD = 'VmHWM:'  # the peak resident set size, in kB
+RESET_PEAK_RSS = '5'  # the clear_refs command which resets the peak resident set size to the current one
+
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of the process, since it started or since the last reset_peak_rss.
+    :return: The peak in bytes, or None if it cannot be read.
+    """
+    try:
+        with open(PROC_STATUS) as status:
+            for line in status:
+                if line.startswith(PEAK_RSS_FIELD):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident set size, so that a long lived worker measures the peak of each task.
+    :return: True if the peak was reset.
+    """
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as clear_refs:
+            clear_refs.write(RESET_PEAK_RSS)
+    except OSError:
+        return False
+
+    return True